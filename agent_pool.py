@@ -0,0 +1,191 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def _rss_bytes():
+    """
+    Resident memory of the process, or 0 when /proc is not available (memory limit disabled).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class PoolEntry:
+    def __init__(self, name, semaphore):
+        self.name = name
+        self.agent = None
+        self.semaphore = semaphore
+        self.build_lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.memory = 0
+
+
+class AgentPool:
+    """
+    Lazily built agents, one per database, kept in an LRU.
+
+    Entries idle for longer than `idle_timeout` seconds are evicted, then the least recently
+    used ones while there are more than `max_entries` or their estimated memory exceeds
+    `max_memory_mb`. Entries that are serving a request are never evicted.
+    Each database accepts at most `max_concurrency` requests at a time, so one busy
+    database cannot take every worker. A background thread applies the limits every
+    `sweep_interval` seconds, so idle databases are released without waiting for a request.
+    The memory of an entry is the growth of the process RSS while its agent was built. Builds
+    are measured one at a time, so two databases built at once are not counted twice.
+
+    :param factory: Callable(name) building the agent of a database.
+    :param close: Callable(name, agent) releasing its resources (engine, connections).
+    :param forget: Callable(name) dropping the per-database caches. Called under the pool lock,
+                   so it never drops the caches of an agent rebuilt meanwhile for the same name.
+    :param allowed: Database names the pool may build agents for, None for any.
+    """
+
+    def __init__(self, factory, close=None, forget=None, allowed=None, max_entries=4, idle_timeout=900,
+                 max_memory_mb=None, max_concurrency=2, acquire_timeout=30, sweep_interval=60):
+        self.factory = factory
+        self.close = close
+        self.forget = forget
+        self.allowed = set(allowed) if allowed is not None else None
+        self.max_entries = max_entries
+        self.idle_timeout = idle_timeout
+        self.max_memory = max_memory_mb * 1024 * 1024 if max_memory_mb else None
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.measure_lock = threading.Lock()
+        if sweep_interval:
+            threading.Thread(target=self._sweep, args=(sweep_interval,), daemon=True).start()
+
+    def _sweep(self, interval):
+        while True:
+            time.sleep(interval)
+            self.evict()
+
+    def allows(self, name):
+        return self.allowed is None or name in self.allowed
+
+    def __contains__(self, name):
+        with self.lock:
+            return name in self.entries and self.entries[name].agent is not None
+
+    def agents(self):
+        """
+        {name: agent} of the built entries, a snapshot taken under the pool lock.
+        """
+        with self.lock:
+            return {name: entry.agent for name, entry in self.entries.items() if entry.agent is not None}
+
+    @contextmanager
+    def acquire(self, name):
+        """
+        Yields the agent of a database, building it on first use.
+
+        :raises ValueError: when the database is not allowed.
+        :raises TimeoutError: when the database is already serving max_concurrency requests
+                              for longer than acquire_timeout seconds.
+        """
+        if not self.allows(name):
+            raise ValueError(f"Unknown database '{name}'")
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                entry = PoolEntry(name, threading.BoundedSemaphore(self.max_concurrency))
+                self.entries[name] = entry
+            self.entries.move_to_end(name)
+            entry.in_use += 1
+
+        try:
+            if not entry.semaphore.acquire(timeout=self.acquire_timeout):
+                raise TimeoutError(f"Database '{name}' is busy, try again later")
+            try:
+                self._build(entry)
+                entry.last_used = time.monotonic()
+                yield entry.agent
+            finally:
+                entry.semaphore.release()
+        finally:
+            with self.lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+            self.evict()
+
+    def _build(self, entry):
+        # Only one thread builds a given agent, the others wait for it
+        with entry.build_lock:
+            if entry.agent is None:
+                # The RSS growth is only this agent's while no other agent is being built
+                with self.measure_lock:
+                    before = _rss_bytes()
+                    agent = self.factory(entry.name)
+                    entry.memory = max(_rss_bytes() - before, 0)
+                entry.agent = agent
+
+    def _forget(self, entry):
+        if self.forget:
+            self.forget(entry.name)
+
+    def _release(self, entry):
+        if entry.agent is not None and self.close:
+            self.close(entry.name, entry.agent)
+        entry.agent = None
+
+    def evict(self):
+        """
+        Releases idle entries, then least recently used ones while over the limits.
+        """
+        now = time.monotonic()
+        evicted = []
+        with self.lock:
+            for name, entry in list(self.entries.items()):
+                if entry.in_use == 0 and now - entry.last_used > self.idle_timeout:
+                    evicted.append(self.entries.pop(name))
+
+            def over_limits():
+                built = [e for e in self.entries.values() if e.agent is not None]
+                too_many = len(built) > self.max_entries
+                too_big = self.max_memory is not None and sum(e.memory for e in built) > self.max_memory
+                return too_many or too_big
+
+            # OrderedDict keeps the least recently used entries first
+            for name, entry in list(self.entries.items()):
+                if not over_limits():
+                    break
+                if entry.in_use == 0:
+                    evicted.append(self.entries.pop(name))
+
+            for entry in evicted:
+                self._forget(entry)
+
+        for entry in evicted:
+            self._release(entry)
+        return [entry.name for entry in evicted]
+
+    def clear(self):
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+            for entry in entries:
+                self._forget(entry)
+        for entry in entries:
+            self._release(entry)
+
+    def stats(self):
+        with self.lock:
+            return [
+                {
+                    "database": e.name,
+                    "built": e.agent is not None,
+                    "in_use": e.in_use,
+                    "idle_seconds": round(time.monotonic() - e.last_used, 1),
+                    "memory_mb": round(e.memory / 1024 / 1024, 1),
+                }
+                for e in self.entries.values()
+            ]
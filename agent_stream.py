@@ -0,0 +1,235 @@
+import ast
+import json
+import time
+import uuid
+import asyncio
+import datetime
+from decimal import Decimal
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from request_profiler import InlineExecutor, profiling
+from sql_tools import REPAIR_NOTE, REPAIR_RESULT
+
+# Number of result rows sent as soon as a query returns
+PREVIEW_ROWS = 5
+
+
+# Constructors found in the repr of result rows (Postgres NUMERIC, DATE, ...), the only calls evaluated
+ROW_VALUE_TYPES = {
+    "Decimal": Decimal,
+    "datetime.date": datetime.date,
+    "datetime.datetime": datetime.datetime,
+    "datetime.time": datetime.time,
+    "datetime.timedelta": datetime.timedelta,
+    "UUID": uuid.UUID,
+}
+
+
+def _call_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return f"{_call_name(node.value)}.{node.attr}"
+    return None
+
+
+def _row_value(node):
+    # ast.literal_eval plus the value types of ROW_VALUE_TYPES
+    if isinstance(node, ast.Call) and _call_name(node.func) in ROW_VALUE_TYPES and not node.keywords:
+        return ROW_VALUE_TYPES[_call_name(node.func)](*[_row_value(arg) for arg in node.args])
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_row_value(item) for item in node.elts]
+    return ast.literal_eval(node)
+
+
+def preview_rows(observation, limit=PREVIEW_ROWS):
+    """
+    First rows of an sql_db_query result as a list of rows, whatever the backend. The tool
+    returns the rows as the text of a list of tuples (after the note of a repaired query).
+    Returns None when the observation holds no rows (an error).
+    """
+    text = getattr(observation, "content", observation)
+    if not isinstance(text, str):
+        return None
+    if text.startswith(REPAIR_NOTE):
+        text = text.partition(REPAIR_RESULT)[2]
+    if not text.strip():
+        return []
+    try:
+        rows = _row_value(ast.parse(text.strip(), mode="eval").body)
+    except (ValueError, TypeError, SyntaxError, ArithmeticError):
+        return None
+    if not isinstance(rows, list):
+        return None
+    return [row if isinstance(row, list) else [row] for row in rows[:limit]]
+
+
+async def astream_answer(runnable, inputs, config=None):
+    """
+    Streams the progress of one agent run as events:
+    - {"type": "sql", "query": ...} as soon as the model wrote a query
+    - {"type": "rows", "rows": [...]} with the first rows once that query returned,
+      rows [] and the text in "error" when it failed
+    - {"type": "token", "text": ...} for each token of the answer
+    - {"type": "final", "output": ..., "intermediate_steps": [...]} at the end
+    """
+    final = None
+    # Runs of tools: models they call themselves (sql_db_query_checker) are not the answer
+    tool_runs = set()
+    async for event in runnable.astream_events(inputs, config=config, version="v2"):
+        kind = event["event"]
+
+        if kind == "on_tool_start":
+            tool_runs.add(event["run_id"])
+
+        if kind == "on_tool_start" and event["name"] == "sql_db_query":
+            tool_input = event["data"].get("input", {})
+            query = tool_input.get("query", tool_input) if isinstance(tool_input, dict) else tool_input
+            yield {"type": "sql", "query": str(query)}
+
+        elif kind == "on_tool_end" and event["name"] == "sql_db_query":
+            output = event["data"].get("output")
+            rows = preview_rows(output)
+            if rows is None:
+                yield {"type": "rows", "rows": [], "error": str(getattr(output, "content", output))[:500]}
+            else:
+                yield {"type": "rows", "rows": rows}
+
+        elif kind == "on_chat_model_stream" and not tool_runs.intersection(event.get("parent_ids", ())):
+            text = event["data"]["chunk"].content
+            if isinstance(text, str) and text:
+                yield {"type": "token", "text": text}
+
+        elif kind == "on_chain_end" and not event.get("parent_ids"):
+            # End of the outermost runnable: the complete agent response
+            final = event["data"].get("output")
+
+    final = final or {}
+    yield {"type": "final", "output": final.get("output", ""), "intermediate_steps": final.get("intermediate_steps", [])}
+
+
+async def _cancel_pending_tasks():
+    tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def stream_answer(runnable, inputs, config=None):
+    """
+    Synchronous version of astream_answer(), for the CLI and threaded servers.
+    Runs the event stream on a private event loop and yields the events as they arrive.
+    """
+    loop = asyncio.new_event_loop()
+    if profiling.get():
+        # The tools would run in the loop's worker threads, out of sight of cProfile
+        loop.set_default_executor(InlineExecutor())
+    events = astream_answer(runnable, inputs, config)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(events.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        # Closed early (client gone) or finished: the agent run may still have tasks in flight,
+        # cancel them before closing the event stream and the loop
+        try:
+            loop.run_until_complete(_cancel_pending_tasks())
+            loop.run_until_complete(events.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
+
+
+def to_json_line(event):
+    """
+    Serializes an event as one line of NDJSON (intermediate steps are not serializable, they are dropped).
+    """
+    event = {key: value for key, value in event.items() if key != "intermediate_steps"}
+    return json.dumps(event, default=str) + "\n"
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Stub chat model for benchmarks: replays scripted messages (tool calls, then the answer),
+    waiting `first_token_delay` seconds before each reply and `token_delay` between answer tokens.
+    """
+
+    script: list
+    first_token_delay: float = 0.5
+    token_delay: float = 0.02
+    position: int = 0
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _next_message(self):
+        message = self.script[self.position % len(self.script)]
+        self.position += 1
+        return message
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._next_message()
+        time.sleep(self.first_token_delay + self.token_delay * len(message.content.split()))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._next_message()
+        time.sleep(self.first_token_delay)
+        if message.tool_calls:
+            call = message.tool_calls[0]
+            chunk = AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}
+            ])
+            yield ChatGenerationChunk(message=chunk)
+            return
+        for word in message.content.split(" "):
+            time.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+if __name__ == "__main__":
+    # Time-to-first-byte of invoke() vs the event stream, with a stub LLM that streams
+    # (0.5s before each reply, 20ms per token) on a local copy of the bike store data.
+    from langchain_community.utilities import SQLDatabase
+    from langchain_community.agent_toolkits import create_sql_agent
+    from local_db import create_local_engine
+    from sql_tools import AgentSQLDatabaseToolkit
+
+    query = ("SELECT s.store_name, SUM(oi.quantity * oi.list_price * (1 - oi.discount)) AS revenue FROM stores s "
+             "JOIN orders o ON o.store_id = s.store_id JOIN order_items oi ON oi.order_id = o.order_id "
+             "GROUP BY s.store_name ORDER BY revenue DESC")
+    answer = "Baldwin Bikes generated the most revenue, followed by Santa Cruz Bikes and Rowlett Bikes. " * 4
+    db = SQLDatabase(create_local_engine())
+
+    def build_agent():
+        llm = ScriptedChatModel(script=[
+            AIMessage(content="", tool_calls=[{"name": "sql_db_query", "args": {"query": query}, "id": "call_1"}]),
+            AIMessage(content=answer.strip()),
+        ])
+        return create_sql_agent(llm=llm, toolkit=AgentSQLDatabaseToolkit(db=db, llm=llm), agent_type="openai-tools",
+                                agent_executor_kwargs={"return_intermediate_steps": True})
+
+    question = {"input": "What is the total revenue generated by each store?"}
+
+    start = time.perf_counter()
+    build_agent().invoke(question)
+    invoke_time = time.perf_counter() - start
+    print(f"invoke(): first byte after {invoke_time:.2f}s (nothing is shown before the full answer)")
+
+    start = time.perf_counter()
+    first = {}
+    for event in stream_answer(build_agent(), question):
+        first.setdefault(event["type"], time.perf_counter() - start)
+    print(f"stream:   first byte (SQL) after {first['sql']:.2f}s, first rows after {first['rows']:.2f}s, "
+          f"first answer token after {first['token']:.2f}s, done after {first['final']:.2f}s")
+    print(f"Time-to-first-byte reduced {invoke_time / first['sql']:.1f}x")
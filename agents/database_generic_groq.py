@@ -1,23 +1,48 @@
 import os
+import groq
 import pandas as pd
+from typing import ClassVar
 from dotenv import load_dotenv
 from langchain_groq import ChatGroq
 from langchain_community.utilities import SQLDatabase
 from langchain_community.agent_toolkits import create_sql_agent
 from urllib.parse import quote_plus
-from schema_metadata import bike_store_metadata, bank_metadata
+from schema_metadata import bike_store_metadata, bank_metadata, bike_store_aggregate_metadata
+from aggregates import has_aggregates
+from sql_tools import AgentSQLDatabaseToolkit, JoinPathTool, executed_query
+from schema_profiler import profile_database, format_profiles, DEFAULT_CACHE_FILE, DEFAULT_SAMPLE_ROWS
+from example_retriever import ExampleIndex, build_index, format_examples, DEFAULT_INDEX_FILE
+from query_log import STOPPED_ANSWER
+from agent_pool import AgentPool
+from join_graph import build_join_graph
+from agent_stream import stream_answer
+from deadlines import DeadlineAgentExecutor, DeadlineChatModel, install_deadline_hooks, run_cancellable
+from request_profiler import RequestProfiler, DEFAULT_PROFILE_DIR
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 
 # Load environment variables
 load_dotenv()
 
-def get_db_connection_uri():
+# Output of the executor when it stopped before a final answer (deadline or iteration limit)
+STOPPED_OUTPUT = "Agent stopped due to max iterations."
+
+
+class DeadlineChatGroq(DeadlineChatModel, ChatGroq):
+    """
+    ChatGroq whose calls are bounded by the current request deadline (deadlines.py).
+    Retries happen in DeadlineChatModel, within the time left, not in the Groq client.
+    """
+
+    retry_on: ClassVar[tuple] = (groq.APIConnectionError, groq.RateLimitError, groq.InternalServerError)
+
+
+def get_db_connection_uri(dbname=None):
     db_type = os.getenv("DB_TYPE", "postgres").lower()
     user = os.getenv("DB_USER")
     password = os.getenv("DB_PASSWORD")
     host = os.getenv("DB_HOST", "localhost")
     port = os.getenv("DB_PORT")
-    dbname = os.getenv("DB_NAME")
+    dbname = dbname or os.getenv("DB_NAME")
     
     encoded_password = quote_plus(password)
 
@@ -43,7 +68,96 @@ def get_db_connection_uri():
         raise ValueError(f"Unsupported DB_TYPE: {db_type}")
 
 
-def get_agent():
+def get_column_stats(db):
+    """
+    Profiles the connected database and returns {table_name: statistics text}.
+    Set SCHEMA_PROFILING=0 to disable it.
+    """
+    if os.getenv("SCHEMA_PROFILING", "1") == "0":
+        return {}
+
+    cache_file = os.getenv("SCHEMA_PROFILE_CACHE", DEFAULT_CACHE_FILE)
+    sample_rows = int(os.getenv("SCHEMA_PROFILE_SAMPLE_ROWS", DEFAULT_SAMPLE_ROWS))
+    try:
+        profiles = profile_database(db._engine, db.get_usable_table_names(), cache_file, sample_rows)
+        return format_profiles(profiles)
+    except Exception as e:
+        # Profiling only enriches the prompt, the agent works without it
+        print(f"Warning: column profiling failed: {e}")
+        return {}
+
+
+# Few-shot example indexes, one per database
+example_indexes = {}
+
+def get_example_index(dbname, db=None):
+    """
+    Returns the example index of a database, loading it from EXAMPLE_INDEX_FILE.
+    When no index was built offline, it is built from query_history.txt (validated on db).
+    """
+    if dbname not in example_indexes:
+        index_file = os.getenv("EXAMPLE_INDEX_FILE", DEFAULT_INDEX_FILE)
+        index = ExampleIndex.load(index_file, dbname)
+        if not len(index) and os.path.exists("query_history.txt"):
+            index = build_index(db=db)
+        example_indexes[dbname] = index
+    return example_indexes[dbname]
+
+
+# Join graphs, one per database
+join_graphs = {}
+
+def get_join_graph(dbname, db, metadata=None, avoid=()):
+    """
+    Returns the join graph of a database, built once from its foreign keys (or the metadata notes).
+    """
+    if dbname not in join_graphs:
+        join_graphs[dbname] = build_join_graph(db, metadata, avoid)
+    return join_graphs[dbname]
+
+
+# Curated schema notes of the known databases
+metadata_map = {
+    "bike_store": bike_store_metadata,
+    "massive-bank": bank_metadata
+}
+
+
+def allowed_databases():
+    """
+    Databases questions may target, from DB_NAMES (comma-separated). Defaults to DB_NAME plus
+    the databases with curated metadata, only DB_NAME for SQLite where a name is a file path.
+    """
+    names = os.getenv("DB_NAMES")
+    if names:
+        return {name.strip() for name in names.split(",") if name.strip()}
+    default = {os.getenv("DB_NAME", "")}
+    if os.getenv("DB_TYPE", "postgres").lower() == "sqlite":
+        return default
+    return default | set(metadata_map)
+
+
+def get_sql_database(dbname=None):
+    db_uri = get_db_connection_uri(dbname)
+
+    # Per-database connection limits, so one busy database cannot hold every connection
+    engine_args = {}
+    if not db_uri.startswith("sqlite"):
+        engine_args = {
+            "pool_size": int(os.getenv("DB_POOL_SIZE", 2)),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 1)),
+            "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", 30)),
+            "pool_pre_ping": True,
+        }
+
+    # No longer passing custom_table_info needed, we will inspect dynamically
+    db = SQLDatabase.from_uri(db_uri, engine_args=engine_args)
+    # Statements stop with the request deadline (statement_timeout / cancel on Postgres)
+    install_deadline_hooks(db._engine)
+    return db
+
+
+def get_agent(dbname=None):
     # LLM Setup for Groq
     api_key = os.getenv("GROQ_API_KEY")
     # Using Llama 3 70B for strong reasoning capabilities
@@ -52,33 +166,52 @@ def get_agent():
     if not api_key:
         print("Warning: GROQ_API_KEY not found in environment variables.")
 
-    llm = ChatGroq(
+    llm = DeadlineChatGroq(
         model=model_name,
         groq_api_key=api_key,
         temperature=0,
+        request_timeout=float(os.getenv("LLM_TIMEOUT", 60)),
+        max_retries=0,
+        retries=int(os.getenv("LLM_MAX_RETRIES", 2)),
     )
 
-    db_uri = get_db_connection_uri()
-    # No longer passing custom_table_info needed, we will inspect dynamically
-    db = SQLDatabase.from_uri(db_uri)
+    # Determine which metadata to use based on the requested database (DB_NAME by default)
+    dbname = dbname or os.getenv("DB_NAME", "")
+    db = get_sql_database(dbname)
 
-    # Determine which metadata to use based on DB_NAME
-    dbname = os.getenv("DB_NAME", "")
-    metadata_map = {
-        "bike_store": bike_store_metadata,
-        "massive-bank": bank_metadata
+    # Summary tables the agent should prefer, registered only once they are built
+    aggregate_metadata_map = {
+        "bike_store": bike_store_aggregate_metadata
     }
     
     selected_metadata = metadata_map.get(dbname)
+    if selected_metadata and dbname in aggregate_metadata_map and has_aggregates(db._engine):
+        selected_metadata = {**selected_metadata, **aggregate_metadata_map[dbname]}
+
+    # Load the few-shot examples now so the first question does not pay for it
+    get_example_index(dbname, db)
+
+    # Ready-made join paths, summary tables are never used to connect other tables
+    join_tools = []
+    if os.getenv("JOIN_PATH_TOOL", "1") != "0":
+        graph = get_join_graph(dbname, db, selected_metadata, avoid=aggregate_metadata_map.get(dbname, {}))
+        join_tools.append(JoinPathTool(graph=graph))
+
+    # Sampled column statistics (types, nulls, ranges, common values), cached per table fingerprint
+    column_stats = get_column_stats(db)
     
     if selected_metadata:
         # Format curated metadata for system prompt
         schema_description = f"Here is the Database Schema for {dbname} you must use:\n"
         for table, description in selected_metadata.items():
             schema_description += f"\nTable: {table}\n{description}\n"
+            if table in column_stats:
+                schema_description += f"{column_stats[table]}\n"
     else:
         # Fallback to dynamic inspection
         schema_description = f"Here is the schema of the database you are connected to:\n{db.get_table_info()}"
+        for table, stats in column_stats.items():
+            schema_description += f"\nTable: {table}\n{stats}\n"
 
     # Custom Prompt Template
     # We explicitly tell Llama how to behave and where the schema is.
@@ -93,6 +226,9 @@ def get_agent():
     4. Start by listing tables if you are unsure, but TRUST the schema above first.
     5. Always LIMIT results to 10 unless specified otherwise.
     6. Double check your query logic before executing.
+    {"7. When a question needs several tables, call sql_db_join_path with their names to get the joins." if join_tools else ""}
+
+    {{few_shot_examples}}
     """
 
     prompt = ChatPromptTemplate.from_messages([
@@ -101,18 +237,85 @@ def get_agent():
         ("human", "{input}"),
         MessagesPlaceholder("agent_scratchpad"),
     ])
+    # Filled per question with retrieved examples, empty unless the caller provides them
+    prompt = prompt.partial(few_shot_examples="")
 
     # Create SQL Agent
+    # The toolkit repairs unknown table / column names locally before the LLM sees the error
     agent_executor = create_sql_agent(
         llm=llm,
-        db=db,
+        # SQL_FINGERPRINTING=1 sends queries as prepared statements instead of plain text
+        # (opt-in until the Postgres PREPARE path has been checked against a real server)
+        toolkit=AgentSQLDatabaseToolkit(db=db, llm=llm, fingerprinting=os.getenv("SQL_FINGERPRINTING", "0") == "1"),
         prompt=prompt, # Inject our custom prompt
         verbose=True,
         agent_type="openai-tools",
+        extra_tools=join_tools,
+        max_iterations=int(os.getenv("AGENT_MAX_ITERATIONS", 15)),
+        max_execution_time=float(os.getenv("REQUEST_TIMEOUT", 120)),
         agent_executor_kwargs={"return_intermediate_steps": True},
     )
     
-    return agent_executor
+    # Also stops at the request deadline, returning the steps done so far
+    return DeadlineAgentExecutor.from_executor(agent_executor)
+
+
+def close_agent(dbname, agent):
+    """
+    Releases the connection pool of an agent built by get_agent().
+    """
+    for tool in agent.tools:
+        db = getattr(tool, "db", None)
+        if db is not None:
+            db._engine.dispose()
+
+
+def forget_database(dbname):
+    """
+    Drops the caches get_agent() filled for a database: its example index and join graph.
+    """
+    example_indexes.pop(dbname, None)
+    join_graphs.pop(dbname, None)
+
+
+def query_stats(agent, limit=10):
+    """
+    Hottest query shapes run by an agent (count and latency per fingerprint).
+    """
+    for tool in agent.tools:
+        if getattr(tool, "runner", None) is not None:
+            return tool.runner.stats.hot(limit)
+    return []
+
+
+def create_agent_pool():
+    """
+    One lazily built agent per database of allowed_databases(), limited by AGENT_POOL_SIZE,
+    AGENT_IDLE_TIMEOUT (seconds), AGENT_POOL_MEMORY_MB and DB_MAX_CONCURRENCY (simultaneous
+    requests per database).
+    """
+    return AgentPool(
+        get_agent,
+        close_agent,
+        forget_database,
+        allowed=allowed_databases(),
+        max_entries=int(os.getenv("AGENT_POOL_SIZE", 4)),
+        idle_timeout=float(os.getenv("AGENT_IDLE_TIMEOUT", 900)),
+        max_memory_mb=float(os.getenv("AGENT_POOL_MEMORY_MB", 0)) or None,
+        max_concurrency=int(os.getenv("DB_MAX_CONCURRENCY", 2)),
+    )
+
+
+def parse_target(user_query, default_dbname):
+    """
+    Questions can name their database with an @ prefix: "@massive-bank top transactions in 2022".
+    Returns (database, question).
+    """
+    if user_query.startswith("@"):
+        target, _, question = user_query[1:].partition(" ")
+        if target and question.strip():
+            return target, question.strip()
+    return default_dbname, user_query
 
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
@@ -125,6 +328,117 @@ def get_session_history(session_id: str):
         store[session_id] = ChatMessageHistory()
     return store[session_id]
 
+def extract_sql_query(response):
+    """
+    Returns the last successful query executed by the agent.
+    """
+    sql_query = "No successful SQL Query generated"
+
+    # Iterate through all steps to find the LAST SUCCESSFUL executed query
+    for step in response.get("intermediate_steps", []):
+        action = step[0]
+        observation = step[1] # The result/output of the tool
+
+        if action.tool == "sql_db_query":
+            # Check if the query failed
+            if isinstance(observation, str) and "Error" in observation:
+                continue
+
+            # Use the repaired query when the tool fixed it locally
+            sql_query = executed_query(action.tool_input, observation)
+
+    return sql_query
+
+
+def create_profiler():
+    """
+    Profiles every PROFILE_EVERY-th question (0: only on demand) into PROFILE_DIR,
+    tracking the growth of the chat histories and example indexes.
+    """
+    return RequestProfiler(
+        every=int(os.getenv("PROFILE_EVERY", 0)),
+        directory=os.getenv("PROFILE_DIR", DEFAULT_PROFILE_DIR),
+        tracked={"store": store, "example_indexes": example_indexes},
+    )
+
+
+def wrap_with_history(agent):
+    # Wrap agent with memory, histories are kept per database
+    return RunnableWithMessageHistory(
+        agent,
+        get_session_history,
+        input_messages_key="input",
+        history_messages_key="chat_history",
+    )
+
+
+def partial_answer(response):
+    """
+    Best answer of an agent stopped by the deadline or the iteration limit: the last query result.
+    """
+    for action, observation in reversed(response.get("intermediate_steps", [])):
+        if action.tool == "sql_db_query" and not (isinstance(observation, str) and "Error" in observation):
+            return f"{STOPPED_ANSWER} (time or iteration limit). Last query result: {observation}"
+    return f"{STOPPED_ANSWER} (time or iteration limit), no query succeeded."
+
+
+def record_answer(dbname, example_index, user_query, response):
+    """
+    Logs an agent response and returns (sql_query, answer).
+    """
+    sql_query = extract_sql_query(response)
+    answer = response['output']
+    stopped = answer == STOPPED_OUTPUT
+    if stopped:
+        answer = partial_answer(response)
+
+    # Log to file
+    log_query(user_query, sql_query, answer)
+
+    # Make the successful query available as an example for the next questions. A stopped run
+    # has no final answer, its last query is often only exploratory and not an example to follow.
+    if not stopped and sql_query != "No successful SQL Query generated":
+        example_index.add(user_query, sql_query)
+        example_index.save(os.getenv("EXAMPLE_INDEX_FILE", DEFAULT_INDEX_FILE), dbname)
+
+    return sql_query, answer
+
+
+def answer_question(pool, dbname, user_query, session_id):
+    """
+    Runs one question against the agent of a database and logs it. Returns (sql_query, answer).
+    """
+    with pool.acquire(dbname) as agent:
+        example_index = get_example_index(dbname)
+
+        # Invoke with session config
+        response = wrap_with_history(agent).invoke(
+            {"input": user_query, "few_shot_examples": format_examples(example_index, user_query)},
+            config={"configurable": {"session_id": f"{dbname}:{session_id}"}}
+        )
+
+    return record_answer(dbname, example_index, user_query, response)
+
+
+def stream_question(pool, dbname, user_query, session_id):
+    """
+    Streaming version of answer_question(): yields the events of agent_stream.astream_answer()
+    (each query as soon as it is generated, its first rows, the answer token by token) and
+    logs the question once the agent finished. The final event also carries "sql_query".
+    """
+    with pool.acquire(dbname) as agent:
+        example_index = get_example_index(dbname)
+        events = stream_answer(
+            wrap_with_history(agent),
+            {"input": user_query, "few_shot_examples": format_examples(example_index, user_query)},
+            config={"configurable": {"session_id": f"{dbname}:{session_id}"}}
+        )
+        for event in events:
+            if event["type"] == "final":
+                event["sql_query"], event["output"] = record_answer(dbname, example_index, user_query, event)
+            yield event
+
+
 def log_query(question, sql_query, answer, log_file="query_history.txt"):
     with open(log_file, "a") as f:
         f.write(f"Timestamp: {pd.Timestamp.now()}\n")
@@ -133,60 +447,71 @@ def log_query(question, sql_query, answer, log_file="query_history.txt"):
         f.write(f"Answer: {answer}\n")
         f.write("-" * 50 + "\n")
 
+def print_answer(pool, dbname, question, session_id, streaming=True):
+    """
+    Answers a question on the console, streamed as it is generated or all at once.
+    """
+    if not streaming:
+        sql_query, answer = answer_question(pool, dbname, question, session_id)
+        print(f"\nGenerated SQL: {sql_query}")
+        print("\nAnswer:", answer)
+        return
+
+    answered = False
+    for event in stream_question(pool, dbname, question, session_id):
+        if event["type"] == "sql":
+            print(f"\nRunning SQL: {event['query']}", flush=True)
+        elif event["type"] == "rows":
+            print(f"Query failed: {event['error']}" if "error" in event else f"First rows: {event['rows']}", flush=True)
+        elif event["type"] == "token":
+            if not answered:
+                print("\nAnswer: ", end="")
+                answered = True
+            print(event["text"], end="", flush=True)
+        elif event["type"] == "final":
+            if not answered:
+                # Stopped before the model answered: show the partial result
+                print(f"\nAnswer: {event['output']}", end="")
+            print(f"\n\nGenerated SQL: {event['sql_query']}")
+
+
 if __name__ == "__main__":
-    agent = get_agent()
-    
-    # Wrap agent with memory
-    agent_with_history = RunnableWithMessageHistory(
-        agent,
-        get_session_history,
-        input_messages_key="input",
-        history_messages_key="chat_history",
-    )
+    pool = create_agent_pool()
+    default_dbname = os.getenv("DB_NAME", "")
+
+    # Build the default database agent up front, others are built on their first question
+    with pool.acquire(default_dbname):
+        pass
     
     print("SQL Agent initialized. Type 'exit' to quit.")
+    print(f"Questions go to '{default_dbname}', prefix one with @<database> to target another database.")
+    print("Press Ctrl-C to cancel a question, type /profile to profile the next one.")
     session_id = "user_session"
+    # AGENT_STREAMING=0 waits for the complete answer instead of printing it as it is generated
+    streaming = os.getenv("AGENT_STREAMING", "1") != "0"
+    # Per-question deadline (seconds) for the agent loop, the LLM calls and the database
+    request_timeout = float(os.getenv("REQUEST_TIMEOUT", 120))
+    profiler = create_profiler()
+    profile_next = False
     
     while True:
         user_query = input("\nAsk a question: ")
         if user_query.lower() in ['exit', 'quit']:
             break
+        if user_query.strip() == "/profile":
+            profile_next = True
+            print(f"The next question will be profiled into {profiler.directory}")
+            continue
         
         try:
-            # Invoke with session config
-            response = agent_with_history.invoke(
-                {"input": user_query},
-                config={"configurable": {"session_id": session_id}}
-            )
-            
-            # Extract SQL query from intermediate steps
-            sql_query = "No successful SQL Query generated"
-            
-            # Iterate through all steps to find the LAST SUCCESSFUL executed query
-            for step in response.get("intermediate_steps", []):
-                action = step[0]
-                observation = step[1] # The result/output of the tool
-                
-                if action.tool == "sql_db_query":
-                    # Check if the query failed
-                    if isinstance(observation, str) and "Error" in observation:
-                        continue
-                        
-                    # Handle both string and dictionary inputs
-                    if isinstance(action.tool_input, dict):
-                         sql_query = action.tool_input.get('query', str(action.tool_input))
-                    else:
-                        sql_query = str(action.tool_input)
-            
-            answer = response['output']
-            
-            # Print to console
-            print(f"\nGenerated SQL: {sql_query}")
-            print("\nAnswer:", answer)
-            
-            # Log to file
-            log_query(user_query, sql_query, answer)
+            dbname, question = parse_target(user_query, default_dbname)
+            profile, profile_next = profile_next, False
+            # Ctrl-C cancels the running LLM / database work and prints the partial result
+            run_cancellable(profiler.run, print_answer, pool, dbname, question, session_id, streaming,
+                            profile=profile, seconds=request_timeout)
             print("\n(Logged to query_history.txt)")
             
         except Exception as e:
             print(f"Error: {e}")
+
+    pool.clear()
@@ -0,0 +1,125 @@
+import os
+import json
+import socket
+import select
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from agent_stream import to_json_line
+from deadlines import request_deadline
+from database_generic_groq import create_agent_pool, create_profiler, parse_target, query_stats, stream_question
+
+pool = create_agent_pool()
+profiler = create_profiler()
+default_dbname = os.getenv("DB_NAME", "")
+# Deadline of each request (seconds), a request body can ask for less with "timeout"
+request_timeout = float(os.getenv("REQUEST_TIMEOUT", 120))
+# How often the connection of a running request is checked for a client that went away
+DISCONNECT_POLL_INTERVAL = 0.2
+
+
+def watch_disconnect(connection, deadline, done, interval=DISCONNECT_POLL_INTERVAL):
+    """
+    Cancels the deadline as soon as the client closes its connection. Nothing is written while
+    a statement or an LLM call runs, so a failed write would only notice it once they ended.
+    """
+    while not done.wait(interval):
+        try:
+            readable, _, _ = select.select([connection], [], [], 0)
+            # Readable with nothing to read: the client closed the connection
+            if readable and not connection.recv(1, socket.MSG_PEEK):
+                break
+        except (OSError, ValueError):
+            break
+    else:
+        return
+    deadline.cancel()
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /ask {"question": ..., "session_id": ..., "database": ..., "timeout": ..., "profile": true}
+
+    Answers with NDJSON, one event per line, flushed as soon as it is produced:
+    {"type": "sql", ...}, {"type": "rows", ...}, {"type": "token", ...} and a last {"type": "final", ...}.
+    GET /pool returns the state of the agent pool, GET /queries the hottest query shapes of each database.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/pool":
+            self._send_json(200, pool.stats())
+        elif self.path == "/queries":
+            self._send_json(200, {name: query_stats(agent) for name, agent in pool.agents().items()})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        if self.path != "/ask":
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            question = request["question"]
+            timeout = min(float(request.get("timeout") or request_timeout), request_timeout)
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {"error": "Expected a JSON body with a 'question'"})
+            return
+
+        dbname, question = parse_target(question, request.get("database") or default_dbname)
+        if not pool.allows(dbname):
+            self._send_json(403, {"error": f"Unknown database '{dbname}'"})
+            return
+        session_id = request.get("session_id", "http_session")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_events():
+            for event in stream_question(pool, dbname, question, session_id):
+                self._send_chunk(to_json_line(event))
+
+        with request_deadline(timeout) as deadline:
+            done = threading.Event()
+            threading.Thread(target=watch_disconnect, args=(self.connection, deadline, done), daemon=True).start()
+            try:
+                # Profiles this request only, whatever the other clients ask for
+                profiler.run(send_events, profile=bool(request.get("profile")))
+            except (BrokenPipeError, ConnectionResetError):
+                # Client went away: cancel its running statement, closing the generator releases the agent
+                deadline.cancel()
+                return
+            except Exception as e:
+                self._send_chunk(to_json_line({"type": "error", "message": str(e)}))
+            finally:
+                done.set()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+if __name__ == "__main__":
+    host = os.getenv("SERVER_HOST", "127.0.0.1")
+    port = int(os.getenv("SERVER_PORT", 8000))
+    server = ThreadingHTTPServer((host, port), AgentRequestHandler)
+    print(f"Streaming answers on http://{host}:{port}/ask")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.clear()
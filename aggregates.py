@@ -0,0 +1,266 @@
+import sys
+import json
+import math
+import time
+from sqlalchemy import inspect, text
+
+# Realized revenue of an order line, see schema_metadata.bike_store_metadata["order_items"]
+REVENUE = "oi.quantity * oi.list_price * (1 - oi.discount)"
+SOURCE_TABLES = ("orders", "order_items")
+STATE_TABLE = "agg_refresh_state"
+
+# Summary tables: name -> (indexed columns, grouping columns, additive measures, SELECT producing the rows,
+# filter selecting only the orders appended after the watermark).
+# Grouping columns come first in each SELECT, followed by the measures.
+AGGREGATES = {
+    "agg_order_revenue": (
+        "order_id",
+        "order_id, customer_id, store_id, staff_id, order_status, order_date",
+        ["items_sold", "revenue"],
+        f"""SELECT o.order_id, o.customer_id, o.store_id, o.staff_id, o.order_status, o.order_date,
+               SUM(oi.quantity) AS items_sold, SUM({REVENUE}) AS revenue
+        FROM orders o JOIN order_items oi ON oi.order_id = o.order_id
+        {{where}}
+        GROUP BY o.order_id, o.customer_id, o.store_id, o.staff_id, o.order_status, o.order_date""",
+        "WHERE o.order_id > :watermark",
+    ),
+    # Built from agg_order_revenue, so it must come after it
+    "agg_store_daily_revenue": (
+        "store_id, order_date, order_status",
+        "store_id, order_date, order_status",
+        ["orders", "items_sold", "revenue"],
+        """SELECT r.store_id, r.order_date, r.order_status,
+               COUNT(*) AS orders, SUM(r.items_sold) AS items_sold, SUM(r.revenue) AS revenue
+        FROM agg_order_revenue r
+        {where}
+        GROUP BY r.store_id, r.order_date, r.order_status""",
+        "WHERE r.order_id > :watermark",
+    ),
+    "agg_product_sales": (
+        "product_id, order_status",
+        "product_id, order_status",
+        ["orders", "quantity_sold", "revenue"],
+        f"""SELECT oi.product_id, o.order_status,
+               COUNT(DISTINCT o.order_id) AS orders, SUM(oi.quantity) AS quantity_sold, SUM({REVENUE}) AS revenue
+        FROM orders o JOIN order_items oi ON oi.order_id = o.order_id
+        {{where}}
+        GROUP BY oi.product_id, o.order_status""",
+        "WHERE o.order_id > :watermark",
+    ),
+}
+DELTA_TABLE = "agg_delta"
+
+
+# Content of the source rows up to a watermark: row counts and sums of the numeric columns the
+# summary tables are built from, so edited values are noticed even when the row counts stay the same.
+# Dates are not covered, the embedder forces a full rebuild after replacing the tables.
+CHECKSUM_QUERY = f"""
+SELECT (SELECT COUNT(*) FROM orders WHERE order_id <= :w),
+       (SELECT COUNT(*) FROM order_items WHERE order_id <= :w),
+       (SELECT SUM(customer_id) FROM orders WHERE order_id <= :w),
+       (SELECT SUM(store_id * order_id) FROM orders WHERE order_id <= :w),
+       (SELECT SUM(staff_id * order_id) FROM orders WHERE order_id <= :w),
+       (SELECT SUM(order_status * order_id) FROM orders WHERE order_id <= :w),
+       (SELECT SUM(oi.quantity) FROM order_items oi WHERE oi.order_id <= :w),
+       (SELECT SUM(oi.product_id * oi.quantity) FROM order_items oi WHERE oi.order_id <= :w),
+       (SELECT SUM({REVENUE}) FROM order_items oi WHERE oi.order_id <= :w)"""
+
+
+def _source_state(conn):
+    """
+    Highest order id, and the checksum of the source rows up to it.
+    """
+    watermark = int(conn.execute(text("SELECT COALESCE(MAX(order_id), 0) FROM orders")).scalar())
+    return watermark, _checksum(conn, watermark)
+
+
+def _checksum(conn, watermark):
+    row = conn.execute(text(CHECKSUM_QUERY), {"w": watermark}).one()
+    return [float(value or 0) for value in row]
+
+
+def _same_checksum(a, b):
+    # Float sums depend on the order rows are added in
+    return len(a) == len(b) and all(math.isclose(x, y, rel_tol=1e-9) for x, y in zip(a, b))
+
+
+def _old_rows_unchanged(conn, state):
+    # Incremental refresh only handles appended orders. Replaced, edited or deleted rows need a full rebuild.
+    watermark, checksum = state
+    return _same_checksum(_checksum(conn, watermark), checksum)
+
+
+def _load_state(conn):
+    row = conn.execute(text(f"SELECT watermark, checksum FROM {STATE_TABLE}")).first()
+    return (int(row[0]), json.loads(row[1])) if row else None
+
+
+def _save_state(conn, state):
+    conn.execute(text(f"DELETE FROM {STATE_TABLE}"))
+    conn.execute(
+        text(f"INSERT INTO {STATE_TABLE} (watermark, checksum) VALUES (:w, :c)"),
+        {"w": state[0], "c": json.dumps(state[1])},
+    )
+
+
+def rebuild_aggregates(conn):
+    """
+    Drops and recreates every summary table from the source tables.
+    """
+    for name, (index, _, _, select, _) in AGGREGATES.items():
+        conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        conn.execute(text(f"CREATE TABLE {name} AS {select.format(where='')}"))
+        conn.execute(text(f"CREATE INDEX ix_{name} ON {name} ({index})"))
+
+    conn.execute(text(f"DROP TABLE IF EXISTS {STATE_TABLE}"))
+    conn.execute(text(f"CREATE TABLE {STATE_TABLE} (watermark BIGINT, checksum TEXT)"))
+
+
+def refresh_incremental(conn, watermark):
+    """
+    Folds the orders appended after the watermark into the summary tables.
+
+    Appended orders only add to the measures (counts, quantities, revenue), so each table
+    aggregates the new orders alone, then merges them with the existing rows of the same keys.
+    """
+    for name, (index, keys, measures, select, new_rows) in AGGREGATES.items():
+        totals = ", ".join(f"SUM({m}) AS {m}" for m in measures)
+        conn.execute(text(f"CREATE TEMPORARY TABLE {DELTA_TABLE} AS {select.format(where=new_rows)}"), {"watermark": watermark})
+        conn.execute(text(f"INSERT INTO {DELTA_TABLE} SELECT * FROM {name} WHERE ({index}) IN (SELECT {index} FROM {DELTA_TABLE})"))
+        conn.execute(text(f"DELETE FROM {name} WHERE ({index}) IN (SELECT {index} FROM {DELTA_TABLE})"))
+        conn.execute(text(f"INSERT INTO {name} SELECT {keys}, {totals} FROM {DELTA_TABLE} GROUP BY {keys}"))
+        conn.execute(text(f"DROP TABLE {DELTA_TABLE}"))
+
+
+def refresh_aggregates(engine, full=False):
+    """
+    Brings the summary tables up to date with orders / order_items.
+
+    New orders appended since the last refresh are folded in incrementally. A full rebuild
+    happens on the first run, when requested, or when the checksum of the rows already
+    summarized changed (e.g. the embedder replaced the tables with edited data).
+
+    :param engine: SQLAlchemy engine of the bike store database.
+    :param full: Force a full rebuild.
+    :return: 'full', 'incremental', 'unchanged' or 'skipped' (source tables missing).
+    """
+    inspector = inspect(engine)
+    if not all(inspector.has_table(table) for table in SOURCE_TABLES):
+        return "skipped"
+    # A state table of an older layout (row counts only) triggers a full rebuild
+    ready = (all(inspector.has_table(table) for table in (*AGGREGATES, STATE_TABLE))
+             and "checksum" in {column["name"] for column in inspector.get_columns(STATE_TABLE)})
+
+    with engine.begin() as conn:
+        previous = _load_state(conn) if ready and not full else None
+
+        if previous is None or not _old_rows_unchanged(conn, previous):
+            rebuild_aggregates(conn)
+            current = _source_state(conn)
+            mode = "full"
+        else:
+            current = _source_state(conn)
+            if current[0] == previous[0]:
+                return "unchanged"
+            refresh_incremental(conn, previous[0])
+            mode = "incremental"
+
+        _save_state(conn, current)
+    return mode
+
+
+def has_aggregates(engine):
+    inspector = inspect(engine)
+    return all(inspector.has_table(name) for name in AGGREGATES)
+
+
+# Same question answered from the source tables and from the summary tables
+BENCHMARK_QUERIES = {
+    "total revenue by store": (
+        f"""SELECT s.store_name, SUM({REVENUE}) AS revenue FROM stores s
+            JOIN orders o ON o.store_id = s.store_id JOIN order_items oi ON oi.order_id = o.order_id
+            WHERE o.order_status = 4 GROUP BY s.store_name ORDER BY revenue DESC""",
+        """SELECT s.store_name, SUM(d.revenue) AS revenue FROM stores s
+            JOIN agg_store_daily_revenue d ON d.store_id = s.store_id
+            WHERE d.order_status = 4 GROUP BY s.store_name ORDER BY revenue DESC""",
+    ),
+    "top customers by spend": (
+        f"""SELECT c.customer_id, c.first_name, c.last_name, SUM({REVENUE}) AS spent FROM customers c
+            JOIN orders o ON o.customer_id = c.customer_id JOIN order_items oi ON oi.order_id = o.order_id
+            GROUP BY c.customer_id, c.first_name, c.last_name ORDER BY spent DESC LIMIT 5""",
+        """SELECT c.customer_id, c.first_name, c.last_name, SUM(r.revenue) AS spent FROM customers c
+            JOIN agg_order_revenue r ON r.customer_id = c.customer_id
+            GROUP BY c.customer_id, c.first_name, c.last_name ORDER BY spent DESC LIMIT 5""",
+    ),
+    "best-selling brands": (
+        """SELECT b.brand_name, SUM(oi.quantity) AS sold FROM order_items oi
+            JOIN products p ON p.product_id = oi.product_id JOIN brands b ON b.brand_id = p.brand_id
+            GROUP BY b.brand_name ORDER BY sold DESC LIMIT 3""",
+        """SELECT b.brand_name, SUM(ps.quantity_sold) AS sold FROM agg_product_sales ps
+            JOIN products p ON p.product_id = ps.product_id JOIN brands b ON b.brand_id = p.brand_id
+            GROUP BY b.brand_name ORDER BY sold DESC LIMIT 3""",
+    ),
+}
+
+
+def _timed(conn, query, runs=5):
+    # Best of several runs to reduce noise
+    best, rows = None, None
+    for _ in range(runs):
+        start = time.perf_counter()
+        rows = conn.execute(text(query)).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, rows
+
+
+if __name__ == "__main__":
+    # python aggregates.py [scale] -> benchmark on a local copy of the data with orders replicated `scale` times
+    from local_db import create_local_engine
+
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    engine = create_local_engine(scale=scale)
+    with engine.connect() as conn:
+        print(f"Scale x{scale}: {conn.execute(text('SELECT COUNT(*) FROM order_items')).scalar()} order items")
+
+    start = time.perf_counter()
+    refresh_aggregates(engine, full=True)
+    print(f"Full refresh: {time.perf_counter() - start:.3f}s")
+
+    with engine.connect() as conn:
+        for question, (raw, aggregated) in BENCHMARK_QUERIES.items():
+            raw_time, raw_rows = _timed(conn, raw)
+            agg_time, agg_rows = _timed(conn, aggregated)
+            # Sums are added in a different order, so compare with a float tolerance
+            same = len(raw_rows) == len(agg_rows) and all(
+                a == b or (isinstance(a, float) and math.isclose(a, b, rel_tol=1e-9))
+                for raw_row, agg_row in zip(raw_rows, agg_rows) for a, b in zip(raw_row, agg_row)
+            )
+            print(f"{question}: source {raw_time * 1000:.1f}ms, summary {agg_time * 1000:.1f}ms "
+                  f"({raw_time / agg_time:.0f}x faster, same result: {same})")
+
+    # Append a batch of new orders and fold them in incrementally
+    with engine.begin() as conn:
+        offset = conn.execute(text("SELECT MAX(order_id) FROM orders")).scalar()
+        conn.execute(text(f"INSERT INTO orders SELECT order_id + {offset}, customer_id, order_status, order_date, "
+                          f"required_date, shipped_date, store_id, staff_id FROM orders WHERE order_id <= 100"))
+        conn.execute(text(f"INSERT INTO order_items SELECT order_id + {offset}, item_id, product_id, quantity, "
+                          f"list_price, discount FROM order_items WHERE order_id <= 100"))
+
+    start = time.perf_counter()
+    mode = refresh_aggregates(engine)
+    print(f"Refresh after appending 100 orders ({mode}): {time.perf_counter() - start:.3f}s")
+
+    check = {
+        name: f"SELECT COUNT(*), SUM({measures[0]}), SUM(revenue) FROM {name}"
+        for name, (_, _, measures, _, _) in AGGREGATES.items()
+    }
+    with engine.connect() as conn:
+        incremental = {name: conn.execute(text(query)).one() for name, query in check.items()}
+    start = time.perf_counter()
+    refresh_aggregates(engine, full=True)
+    print(f"Full refresh for comparison: {time.perf_counter() - start:.3f}s")
+    with engine.connect() as conn:
+        rebuilt = {name: conn.execute(text(query)).one() for name, query in check.items()}
+    same = all(math.isclose(a, b, rel_tol=1e-9) for name in check for a, b in zip(incremental[name], rebuilt[name]))
+    print(f"Incremental matches full rebuild: {same}")
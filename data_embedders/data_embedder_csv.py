@@ -1,11 +1,15 @@
 import pandas as pd
 from sqlalchemy import create_engine
 import os
+import sys
 import glob
 
 
 from urllib.parse import quote_plus
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from aggregates import refresh_aggregates
+
 def upload_csv_to_postgres(csv_files, db_config):
     """
     Uploads a list of CSV files to a PostgreSQL database.
@@ -48,6 +52,14 @@ def upload_csv_to_postgres(csv_files, db_config):
         except Exception as e:
             print(f"Error uploading {file_path}: {e}")
 
+    # Keep the precomputed summary tables in sync with the uploaded data.
+    # if_exists='replace' may have changed any existing row, so rebuild them fully.
+    try:
+        mode = refresh_aggregates(engine, full=True)
+        print(f"Summary tables refreshed ({mode}).")
+    except Exception as e:
+        print(f"Error refreshing summary tables: {e}")
+
 # --- Example Usage ---
 config = {
     'user': 'postgres',
@@ -0,0 +1,395 @@
+import time
+import asyncio
+import threading
+import contextvars
+from typing import ClassVar
+from functools import partial
+from contextlib import contextmanager
+from sqlalchemy import event
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_classic.agents.agent import AgentExecutor
+
+# Checked between SQLite VM instructions, cheap enough to catch a deadline within milliseconds
+SQLITE_PROGRESS_STEPS = 10000
+# Shortest timeout given to an LLM call, below that the call would fail anyway
+MIN_LLM_TIMEOUT = 1.0
+# Wait before the first retry of a failed LLM call, doubled for each next one
+LLM_RETRY_BACKOFF = 0.5
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    """
+    Time budget of one request, shared by the agent loop, the LLM calls and the database.
+    cancel() ends it early (Ctrl-C, client disconnect) and cancels the running statements.
+    """
+
+    def __init__(self, seconds=None):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+        self.cancelled = threading.Event()
+        self._callbacks = set()
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """
+        Seconds left, None without a time limit, 0 once cancelled.
+        """
+        if self.cancelled.is_set():
+            return 0.0
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self):
+        return self.remaining() == 0.0
+
+    def cancel(self):
+        self.cancelled.set()
+        with self._lock:
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                # The statement may have finished in the meantime
+                pass
+
+    def add_callback(self, callback):
+        with self._lock:
+            self._callbacks.add(callback)
+
+    def remove_callback(self, callback):
+        with self._lock:
+            self._callbacks.discard(callback)
+
+
+# Deadline of the request being served. Tools run in the same context (or a copy of it
+# for async runs), so the database hooks see the deadline of their own request.
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+@contextmanager
+def request_deadline(seconds=None):
+    """
+    Runs a block under a new Deadline (seconds=None only makes it cancellable).
+    A nested deadline never outlives the enclosing one.
+    """
+    outer = current_deadline.get()
+    if outer is not None and outer.remaining() is not None:
+        seconds = min(seconds or outer.remaining(), outer.remaining()) or 0.001
+    deadline = Deadline(seconds)
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+def llm_timeout(default):
+    """
+    Timeout of the next LLM call: the client default, shortened to what is left of the request.
+    """
+    deadline = current_deadline.get()
+    remaining = deadline.remaining() if deadline else None
+    if remaining is None:
+        return default
+    return max(min(default or remaining, remaining), MIN_LLM_TIMEOUT)
+
+
+def _deadline_expired():
+    deadline = current_deadline.get()
+    return deadline is not None and deadline.expired()
+
+
+def _retry_delay(attempt, retries):
+    """
+    Seconds to wait before retrying a failed LLM call, None when out of retries
+    or when the request deadline leaves no time for another attempt.
+    """
+    if attempt >= retries:
+        return None
+    delay = LLM_RETRY_BACKOFF * 2 ** attempt
+    deadline = current_deadline.get()
+    remaining = deadline.remaining() if deadline else None
+    if remaining is not None and remaining < delay + MIN_LLM_TIMEOUT:
+        return None
+    return delay
+
+
+async def run_bounded(awaitable):
+    """
+    Awaits under the current request deadline: raises TimeoutError once it expires,
+    and Deadline.cancel() (from any thread, e.g. Ctrl-C) cancels the awaitable right away.
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return await awaitable
+    task = asyncio.ensure_future(awaitable)
+    callback = partial(asyncio.get_running_loop().call_soon_threadsafe, task.cancel)
+    deadline.add_callback(callback)
+    try:
+        if deadline.cancelled.is_set():
+            task.cancel()
+        return await asyncio.wait_for(task, deadline.remaining())
+    finally:
+        deadline.remove_callback(callback)
+
+
+class DeadlineChatModel(BaseChatModel):
+    """
+    Chat model calls bounded by the current request deadline. Put it before the provider model:
+    class DeadlineChatGroq(DeadlineChatModel, ChatGroq), with the client's own retries disabled.
+
+    - each attempt gets what is left of the request as timeout (llm_timeout)
+    - errors of retry_on are retried up to `retries` times, only while time is left for another attempt
+    - async calls stop when the deadline expires and are cancelled by Deadline.cancel(),
+      sync calls only end with their timeout
+    """
+
+    retries: int = 0
+    retry_on: ClassVar[tuple] = ()
+
+    def _with_timeout(self, kwargs):
+        return {**kwargs, "timeout": llm_timeout(getattr(self, "request_timeout", None))}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return super()._generate(messages, stop, run_manager, **self._with_timeout(kwargs))
+            except self.retry_on:
+                delay = _retry_delay(attempt, self.retries)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return await run_bounded(super()._agenerate(messages, stop, run_manager, **self._with_timeout(kwargs)))
+            except self.retry_on:
+                delay = _retry_delay(attempt, self.retries)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        attempt = 0
+        while True:
+            started = False
+            try:
+                for chunk in super()._stream(messages, stop, run_manager, **self._with_timeout(kwargs)):
+                    started = True
+                    yield chunk
+                return
+            except self.retry_on:
+                # Chunks already sent cannot be taken back, only a stream that failed to start is retried
+                delay = None if started else _retry_delay(attempt, self.retries)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        attempt = 0
+        while True:
+            started = False
+            stream = super()._astream(messages, stop, run_manager, **self._with_timeout(kwargs))
+            try:
+                while True:
+                    try:
+                        chunk = await run_bounded(stream.__anext__())
+                    except StopAsyncIteration:
+                        return
+                    started = True
+                    yield chunk
+            except self.retry_on:
+                delay = None if started else _retry_delay(attempt, self.retries)
+                if delay is None:
+                    raise
+            finally:
+                await stream.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+class DeadlineAgentExecutor(AgentExecutor):
+    """
+    AgentExecutor that also stops iterating when the request deadline expired or was cancelled.
+    With early_stopping_method="force" it then returns the steps done so far, also when the
+    deadline ran out in the middle of a step (an LLM call timing out or being cancelled).
+    """
+
+    @classmethod
+    def from_executor(cls, executor):
+        return cls(**{name: getattr(executor, name) for name in AgentExecutor.model_fields})
+
+    def _should_continue(self, iterations, time_elapsed):
+        if _deadline_expired():
+            return False
+        return super()._should_continue(iterations, time_elapsed)
+
+    def _stopped(self, inputs, intermediate_steps):
+        return self._action_agent.return_stopped_response(self.early_stopping_method, intermediate_steps, **inputs)
+
+    def _iter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        try:
+            yield from super()._iter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager)
+        except Exception:
+            if not _deadline_expired():
+                raise
+            yield self._stopped(inputs, intermediate_steps)
+
+    async def _aiter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        try:
+            async for step in super()._aiter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps,
+                                                       run_manager):
+                yield step
+        except (Exception, asyncio.CancelledError):
+            # The LLM call was cancelled by the deadline, not this task (e.g. the stream being closed)
+            task = asyncio.current_task()
+            if not _deadline_expired() or (task is not None and task.cancelling()):
+                raise
+            yield self._stopped(inputs, intermediate_steps)
+
+
+def _register(info, dbapi_connection, dialect, deadline, callback):
+    _release(info, dbapi_connection, dialect)
+    deadline.add_callback(callback)
+    info["deadline_callback"] = (deadline, callback, dialect)
+
+
+def _release(info, dbapi_connection, dialect=None):
+    deadline, callback, dialect = info.pop("deadline_callback", (None, None, dialect))
+    if deadline is None:
+        return
+    deadline.remove_callback(callback)
+    if dialect == "sqlite":
+        dbapi_connection.set_progress_handler(None, 0)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    deadline = current_deadline.get()
+    if deadline is None:
+        return
+    remaining = deadline.remaining()
+    if remaining == 0.0:
+        raise DeadlineExceeded("Request deadline exceeded, the query was not started")
+
+    dbapi_connection = cursor.connection
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        if remaining is not None:
+            # SET LOCAL only lasts for the current transaction, pooled connections keep no timeout
+            with dbapi_connection.cursor() as setup:
+                setup.execute("SET LOCAL statement_timeout = %s", (max(int(remaining * 1000), 1),))
+        # Ctrl-C / disconnect: ask the server to cancel the running statement
+        callback = dbapi_connection.cancel
+    elif dialect == "sqlite":
+        dbapi_connection.set_progress_handler(lambda: int(deadline.expired()), SQLITE_PROGRESS_STEPS)
+        callback = dbapi_connection.interrupt
+    else:
+        return
+
+    # Kept until the connection goes back to the pool: SQLite does most of the work of a
+    # query while its rows are fetched, after cursor.execute() returned
+    _register(conn.connection.info, dbapi_connection, dialect, deadline, callback)
+
+
+def _checkin(dbapi_connection, connection_record):
+    _release(connection_record.info, dbapi_connection)
+
+
+def install_deadline_hooks(engine):
+    """
+    Bounds every statement of an engine by the current request deadline, until its rows are fetched:
+    - Postgres: SET LOCAL statement_timeout, and a server-side cancel() when the request is cancelled
+    - SQLite: a progress handler interrupting the statement once the deadline passed
+    Statements run outside of a request deadline are not affected.
+    """
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine.pool, "checkin", _checkin)
+    return engine
+
+
+def run_cancellable(function, *args, seconds=None, **kwargs):
+    """
+    Calls function under a new request deadline in a worker thread. Ctrl-C cancels the
+    deadline (stopping the agent loop and the running statement) and waits for the
+    function to return what it has, a second Ctrl-C stops waiting.
+    """
+    result = {}
+    done = threading.Event()
+    with request_deadline(seconds) as deadline:
+        context = contextvars.copy_context()
+
+    def run():
+        try:
+            result["value"] = function(*args, **kwargs)
+        except BaseException as e:
+            result["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=context.run, args=(run,), daemon=True).start()
+    try:
+        # Event.wait() rather than Thread.join(): a Ctrl-C during join() can corrupt the thread state
+        while not done.wait(0.1):
+            pass
+    except KeyboardInterrupt:
+        print("\nCancelling...")
+        deadline.cancel()
+        done.wait()
+
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+if __name__ == "__main__":
+    # A slow query (SQLite recursive CTE, the pg_sleep of this demo) under a 2 second deadline,
+    # with a stub LLM that first runs a fast query, then the slow one.
+    import sys
+    from langchain_core.messages import AIMessage
+    from langchain_community.utilities import SQLDatabase
+    from langchain_community.agent_toolkits import create_sql_agent
+    from agent_stream import ScriptedChatModel
+    from local_db import create_local_engine
+    from sql_tools import AgentSQLDatabaseToolkit
+    # The tools read the deadline of the imported module, not of __main__
+    from deadlines import DeadlineAgentExecutor, install_deadline_hooks, request_deadline, run_cancellable
+
+    slow_query = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 1000000000) SELECT COUNT(*) FROM n"
+    timeout = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    db = SQLDatabase(install_deadline_hooks(create_local_engine()))
+
+    start = time.perf_counter()
+    with request_deadline(timeout):
+        result = db.run_no_throw(slow_query)
+    print(f"Slow query alone: stopped after {time.perf_counter() - start:.2f}s -> {result.splitlines()[0]}")
+
+    llm = ScriptedChatModel(first_token_delay=0.2, script=[
+        AIMessage(content="", tool_calls=[{"name": "sql_db_query", "args": {"query": "SELECT store_name FROM stores"}, "id": "call_1"}]),
+        AIMessage(content="", tool_calls=[{"name": "sql_db_query", "args": {"query": slow_query}, "id": "call_2"}]),
+        AIMessage(content="Done."),
+    ])
+    agent = DeadlineAgentExecutor.from_executor(create_sql_agent(
+        llm=llm, toolkit=AgentSQLDatabaseToolkit(db=db, llm=llm), agent_type="openai-tools",
+        agent_executor_kwargs={"return_intermediate_steps": True},
+    ))
+
+    start = time.perf_counter()
+    response = run_cancellable(agent.invoke, {"input": "List the stores"}, seconds=timeout)
+    print(f"Agent: stopped after {time.perf_counter() - start:.2f}s -> {response['output']!r}")
+    for action, observation in response["intermediate_steps"]:
+        print(f"  {action.tool_input['query'][:40]!r}: {observation.splitlines()[0]}")
+
+    # The connection is free again
+    print("Next query:", db.run_no_throw("SELECT COUNT(*) FROM stores"))
@@ -0,0 +1,223 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from query_log import read_query_history, STOPPED_ANSWERS
+
+DEFAULT_INDEX_FILE = "example_index.json"
+# Character n-gram sizes, robust to typos ("Januray") and word order
+NGRAM_SIZES = (3, 4, 5)
+DEFAULT_TOP_K = 3
+# Examples below this cosine similarity are not worth the prompt tokens
+MIN_SCORE = 0.2
+# Indexes of every database share the index file
+_file_lock = threading.Lock()
+
+
+def normalize_question(question):
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", question.lower())).strip()
+
+
+def char_ngrams(text):
+    """
+    Character n-grams of every word padded with spaces, e.g. ' brand ' -> ' br', 'bra', ...
+    """
+    grams = Counter()
+    for word in text.split():
+        padded = f" {word} "
+        for n in NGRAM_SIZES:
+            for i in range(max(len(padded) - n + 1, 1)):
+                grams[padded[i:i + n]] += 1
+    return grams
+
+
+class ExampleIndex:
+    """
+    TF-IDF index over (question, SQL) pairs using character n-grams.
+
+    Documents are stored as raw n-gram counts with an inverted index, and idf is
+    computed at query time, so adding an example never requires a rebuild.
+    Safe to share between the threads answering questions on the same database.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.examples = []       # [(question, sql)]
+        self.keys = {}           # normalized question -> position in examples
+        self.doc_terms = []      # n-gram counts of each question
+        self.postings = defaultdict(dict)  # n-gram -> {doc: count}
+        self._norms = None
+
+    def __len__(self):
+        return len(self.examples)
+
+    def add(self, question, sql_query):
+        """
+        Adds a successful pair. A question asked again replaces its older SQL,
+        so corrected queries win over earlier attempts.
+        """
+        key = normalize_question(question)
+        if not key:
+            return
+        terms = char_ngrams(key)
+        with self.lock:
+            if key in self.keys:
+                self.examples[self.keys[key]] = (question, sql_query)
+                return
+
+            doc = len(self.examples)
+            self.keys[key] = doc
+            self.examples.append((question, sql_query))
+            self.doc_terms.append(terms)
+            for term, count in terms.items():
+                self.postings[term][doc] = count
+            # Every addition changes the idf of its terms
+            self._norms = None
+
+    def _idf(self, term):
+        return math.log((1 + len(self.examples)) / (1 + len(self.postings.get(term, ())))) + 1
+
+    def _doc_norms(self):
+        if self._norms is None:
+            self._norms = [
+                math.sqrt(sum((count * self._idf(term)) ** 2 for term, count in terms.items())) or 1.0
+                for terms in self.doc_terms
+            ]
+        return self._norms
+
+    def search(self, question, k=DEFAULT_TOP_K, min_score=MIN_SCORE):
+        """
+        Returns up to k (score, question, sql) tuples sorted by cosine similarity.
+        """
+        terms = char_ngrams(normalize_question(question))
+        with self.lock:
+            if not terms or not self.examples:
+                return []
+
+            norms = self._doc_norms()
+            scores = defaultdict(float)
+            query_norm = 0.0
+            for term, count in terms.items():
+                idf = self._idf(term)
+                weight = count * idf
+                query_norm += weight ** 2
+                for doc, doc_count in self.postings.get(term, {}).items():
+                    scores[doc] += weight * doc_count * idf
+
+            query_norm = math.sqrt(query_norm) or 1.0
+            ranked = sorted(((score / (query_norm * norms[doc]), doc) for doc, score in scores.items()), reverse=True)
+            return [(score, *self.examples[doc]) for score, doc in ranked[:k] if score >= min_score]
+
+    def save(self, index_file, database):
+        """
+        Stores the pairs of one database. Other databases in the same file are kept.
+        The file is replaced atomically, a reader never sees it half written.
+        """
+        with self.lock:
+            examples = [list(example) for example in self.examples]
+        with _file_lock:
+            data = {}
+            if os.path.exists(index_file):
+                with open(index_file) as f:
+                    data = json.load(f)
+            data[database] = examples
+            handle, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(index_file)), suffix=".tmp")
+            try:
+                with os.fdopen(handle, "w") as f:
+                    json.dump(data, f, indent=2)
+                os.replace(temp_file, index_file)
+            except BaseException:
+                os.remove(temp_file)
+                raise
+
+    @classmethod
+    def load(cls, index_file, database):
+        index = cls()
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                for question, sql_query in json.load(f).get(database, []):
+                    index.add(question, sql_query)
+        return index
+
+
+def build_index(log_file="query_history.txt", db=None):
+    """
+    Builds an index from the successful queries of the query log, runs stopped before
+    a final answer excluded.
+
+    :param log_file: Path to the query history file.
+    :param db: Optional SQLDatabase. When given, only queries that are valid on it
+               (checked with EXPLAIN) are kept, which drops failed attempts and
+               queries that belong to other databases.
+    :return: ExampleIndex.
+    """
+    index = ExampleIndex()
+    for entry in read_query_history(log_file):
+        if not entry["sql_query"] or not entry["question"] or entry["answer"].startswith(STOPPED_ANSWERS):
+            continue
+        if db is not None and db.run_no_throw(f"EXPLAIN {entry['sql_query']}").startswith("Error:"):
+            continue
+        index.add(entry["question"], entry["sql_query"])
+    return index
+
+
+def format_examples(index, question, k=DEFAULT_TOP_K):
+    """
+    Renders the k most similar past questions as a prompt section, or "" when none is relevant.
+    """
+    matches = index.search(question, k)
+    if not matches:
+        return ""
+
+    text = "Similar questions answered successfully before (reuse their tables, joins and formulas when they apply):\n"
+    for _, past_question, sql_query in matches:
+        text += f"\nQuestion: {past_question}\nSQL: {sql_query}\n"
+    return text
+
+
+def read_questions(questions_file="questions.txt"):
+    # questions.txt keeps each question between double quotes
+    with open(questions_file) as f:
+        return re.findall(r'^"(.+)"\s*$', f.read(), re.M)
+
+
+def measure(agent, index, questions, k=DEFAULT_TOP_K):
+    """
+    Runs every question with and without retrieved examples and returns
+    {mode: (average agent iterations, average seconds)}.
+    """
+    results = {}
+    for mode in ("without examples", "with examples"):
+        iterations, elapsed = [], []
+        for question in questions:
+            examples = format_examples(index, question, k) if mode == "with examples" else ""
+            start = time.perf_counter()
+            response = agent.invoke({"input": question, "few_shot_examples": examples})
+            elapsed.append(time.perf_counter() - start)
+            iterations.append(len(response.get("intermediate_steps", [])))
+        results[mode] = (sum(iterations) / len(iterations), sum(elapsed) / len(elapsed))
+    return results
+
+
+if __name__ == "__main__":
+    # python example_retriever.py           -> build the index offline from query_history.txt
+    # python example_retriever.py measure   -> compare agent iterations and latency with / without examples
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "agents"))
+    from database_generic_groq import get_agent, get_example_index, get_sql_database
+
+    database = os.getenv("DB_NAME", "")
+    index = build_index(db=get_sql_database(database))
+    index.save(os.getenv("EXAMPLE_INDEX_FILE", DEFAULT_INDEX_FILE), database)
+    print(f"Indexed {len(index)} successful queries for {database}.")
+
+    if "measure" in sys.argv[1:]:
+        agent = get_agent()
+        agent.verbose = False
+        questions = read_questions()
+        for mode, (iterations, seconds) in measure(agent, get_example_index(database), questions).items():
+            print(f"{mode}: {iterations:.2f} iterations, {seconds:.2f}s per question")
@@ -0,0 +1,254 @@
+import re
+import sys
+from collections import deque, namedtuple
+from sqlalchemy import inspect
+from sql_repair import get_catalog, singular
+
+# Where an edge comes from, the most reliable source wins when several describe the same column
+SOURCE_RANK = {"foreign key": 0, "metadata": 1, "naming": 2}
+
+# "- brand_id (Integer): Foreign Key referencing brands." / "Self-referencing FK to staffs" / "references orders"
+METADATA_COLUMN_PATTERN = re.compile(r"^\s*-\s*([\w, ]+?)\s*\([^)]*\)\s*:(.*)$", re.M)
+METADATA_REFERENCE_PATTERN = re.compile(r"\b(?:referencing|references|FK to)\s+(?!FK\b)(\w+)", re.I)
+
+
+class Edge(namedtuple("Edge", ["table", "column", "ref_table", "ref_column", "source"])):
+    """
+    table.column = ref_table.ref_column, ref_table == table for a self join.
+    """
+
+    def condition(self, table_alias=None, ref_alias=None):
+        return f"{table_alias or self.table}.{self.column} = {ref_alias or self.ref_table}.{self.ref_column}"
+
+
+def _primary_key(table, columns):
+    # Bike store convention: brands -> brand_id, categories -> category_id
+    key = f"{singular(table)}_id"
+    return key if key in columns else None
+
+
+def reflected_edges(engine, tables):
+    inspector = inspect(engine)
+    edges = []
+    for table in tables:
+        for fk in inspector.get_foreign_keys(table):
+            if fk["referred_table"] not in tables:
+                continue
+            for column, ref_column in zip(fk["constrained_columns"], fk["referred_columns"]):
+                edges.append(Edge(table, column, fk["referred_table"], ref_column, "foreign key"))
+    return edges
+
+
+def metadata_edges(metadata, catalog):
+    """
+    Foreign keys described in curated metadata (schema_metadata.py), e.g.
+    "- manager_id (Integer): Self-referencing FK to staffs" -> staffs.manager_id = staffs.staff_id.
+    """
+    edges = []
+    for table, description in metadata.items():
+        if table not in catalog:
+            continue
+        for names, text in METADATA_COLUMN_PATTERN.findall(description):
+            references = [name for name in METADATA_REFERENCE_PATTERN.findall(text) if name in catalog]
+            if not references:
+                continue
+            ref_table = references[0]
+            for column in (name.strip() for name in names.split(",")):
+                if column not in catalog[table]:
+                    continue
+                # The referenced key, manager_id -> staffs.staff_id for a self reference
+                ref_column = _primary_key(ref_table, catalog[ref_table]) or (column if column in catalog[ref_table] else None)
+                if ref_column and (table, column) != (ref_table, ref_column):
+                    edges.append(Edge(table, column, ref_table, ref_column, "metadata"))
+    return edges
+
+
+def naming_edges(catalog):
+    """
+    <entity>_id columns pointing to the table whose key they are named after: orders.customer_id -> customers.
+    """
+    keys = {}
+    for table, columns in catalog.items():
+        key = _primary_key(table, columns)
+        if key:
+            keys.setdefault(key, table)
+
+    edges = []
+    for table, columns in catalog.items():
+        for column in columns:
+            ref_table = keys.get(column)
+            if ref_table and ref_table != table:
+                edges.append(Edge(table, column, ref_table, column, "naming"))
+    return edges
+
+
+class JoinGraph:
+    """
+    Tables as nodes, join conditions as edges. Shortest join paths are found with a
+    breadth-first search, each search step being one join.
+
+    :param avoid: Tables never used to connect other tables (e.g. summary tables, whose
+                  rows do not map one to one to the tables they copy keys from).
+    """
+
+    def __init__(self, tables, edges, avoid=()):
+        self.tables = set(tables)
+        self.avoid = set(avoid)
+        self.edges = {}
+        # One edge per column, from the most reliable source
+        for edge in sorted(edges, key=lambda e: SOURCE_RANK[e.source]):
+            self.edges.setdefault((edge.table, edge.column), edge)
+
+        self.neighbours = {table: [] for table in self.tables}
+        self.self_joins = {table: [] for table in self.tables}
+        for edge in self.edges.values():
+            if edge.table == edge.ref_table:
+                self.self_joins[edge.table].append(edge)
+            else:
+                self.neighbours[edge.table].append((edge.ref_table, edge))
+                self.neighbours[edge.ref_table].append((edge.table, edge))
+        for table in self.neighbours:
+            self.neighbours[table].sort(key=lambda item: (SOURCE_RANK[item[1].source], item[0]))
+
+    def __len__(self):
+        return len(self.edges)
+
+    def _connect(self, tree, target):
+        # Multi-source BFS from every table already joined, returns the edges reaching target
+        previous = {table: None for table in tree}
+        queue = deque(tree)
+        while queue:
+            table = queue.popleft()
+            if table == target:
+                break
+            if table in self.avoid and table not in tree:
+                continue
+            for neighbour, edge in self.neighbours[table]:
+                if neighbour not in previous:
+                    previous[neighbour] = (table, edge)
+                    queue.append(neighbour)
+        if target not in previous:
+            return None
+
+        path = []
+        while previous[target] is not None:
+            target, edge = previous[target]
+            path.append(edge)
+        return path[::-1]
+
+    def join_path(self, tables):
+        """
+        Joins connecting all tables, in an order where each join reaches an already joined table.
+        Tables are connected one at a time, always the closest one first, which gives the
+        shortest path for two tables and a near minimal tree for more.
+
+        :return: (ordered tables, edges), or None when some table cannot be reached.
+        """
+        tables = list(dict.fromkeys(tables))
+        unknown = [t for t in tables if t not in self.tables]
+        if unknown:
+            raise KeyError(f"Unknown tables: {', '.join(unknown)}")
+
+        joined, edges = [tables[0]], []
+        remaining = tables[1:]
+        while remaining:
+            paths = [(path, target) for target in remaining if (path := self._connect(joined, target)) is not None]
+            if not paths:
+                return None
+            path, target = min(paths, key=lambda item: len(item[0]))
+            for edge in path:
+                new_table = edge.ref_table if edge.table in joined else edge.table
+                if new_table not in joined:
+                    joined.append(new_table)
+                edges.append(edge)
+            remaining = [t for t in remaining if t not in joined]
+        return joined, edges
+
+    def format_join_path(self, tables):
+        """
+        Ready to use FROM clause joining the tables, plus the self joins they offer.
+        """
+        try:
+            result = self.join_path(tables)
+        except KeyError as e:
+            return f"Error: {e.args[0]}. Known tables: {', '.join(sorted(self.tables))}"
+        if result is None:
+            return f"Error: no join path connects {', '.join(tables)}"
+
+        joined, edges = result
+        text = f"FROM {joined[0]}"
+        for table, edge in zip(joined[1:], edges):
+            text += f"\nJOIN {table} ON {edge.condition()}"
+
+        for table in dict.fromkeys(tables):
+            for edge in self.self_joins[table]:
+                alias = f"{edge.table[0]}2"
+                text += (f"\nSelf join available: JOIN {edge.table} {alias} "
+                         f"ON {edge.condition(ref_alias=alias)} (use aliases for both copies)")
+        return text
+
+
+def build_join_graph(db, metadata=None, avoid=()):
+    """
+    Join graph of a database from its reflected foreign keys, completed with the foreign keys
+    described in the curated metadata and the <entity>_id naming convention (databases loaded
+    from CSV files have no declared foreign keys).
+    """
+    catalog = get_catalog(db)
+    edges = reflected_edges(db._engine, set(catalog))
+    if metadata:
+        edges += metadata_edges(metadata, catalog)
+    edges += naming_edges(catalog)
+    return JoinGraph(catalog, edges, avoid=[table for table in avoid if table in catalog])
+
+
+def read_join_questions(questions_file="questions.txt"):
+    """
+    Questions of questions.txt with the tables they join: [(question, [tables])].
+    """
+    with open(questions_file) as f:
+        text = f.read()
+    pairs = re.findall(r'^"(.+)"\s*\nJoins:\s*(.+)$', text, re.M)
+    return [(question, re.findall(r"\b[a-z_]+\b", tables)) for question, tables in pairs]
+
+
+def count_iterations(agent, questions):
+    """
+    Average agent steps over questions.
+    """
+    steps = [len(agent.invoke({"input": question}).get("intermediate_steps", [])) for question in questions]
+    return sum(steps) / len(steps)
+
+
+if __name__ == "__main__":
+    # python join_graph.py          -> join paths of the questions.txt join questions, checked on a local copy
+    # python join_graph.py measure  -> agent iterations on those questions with / without the join path tool
+    import os
+    import time
+    from langchain_community.utilities import SQLDatabase
+    from local_db import create_local_engine
+    from schema_metadata import bike_store_metadata
+
+    db = SQLDatabase(create_local_engine())
+    start = time.perf_counter()
+    graph = build_join_graph(db, bike_store_metadata)
+    print(f"Join graph: {len(graph.tables)} tables, {len(graph)} joins, built in {(time.perf_counter() - start) * 1000:.1f}ms\n")
+
+    for question, tables in read_join_questions():
+        start = time.perf_counter()
+        clause = graph.format_join_path(tables)
+        elapsed = (time.perf_counter() - start) * 1000
+        check = db.run_no_throw(f"SELECT COUNT(*) {clause.split(chr(10) + 'Self join')[0]}")
+        print(f"{question}\n  {' / '.join(tables)} ({elapsed:.2f}ms, {'valid' if not check.startswith('Error') else check})")
+        print("  " + clause.replace("\n", "\n  ") + "\n")
+
+    if "measure" in sys.argv[1:]:
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "agents"))
+        from database_generic_groq import get_agent
+
+        questions = [question for question, _ in read_join_questions()]
+        for mode in ("0", "1"):
+            os.environ["JOIN_PATH_TOOL"] = mode
+            agent = get_agent()
+            agent.verbose = False
+            print(f"join path tool {'on' if mode == '1' else 'off'}: {count_iterations(agent, questions):.2f} iterations per question")
@@ -0,0 +1,43 @@
+import os
+import glob
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+
+def scale_frame(df, scale, key="order_id"):
+    """
+    Replicates the rows of a table `scale` times, shifting `key` so every copy gets new ids.
+    """
+    if scale <= 1 or key not in df:
+        return df
+    offset = int(df[key].max())
+    return pd.concat([df.assign(**{key: df[key] + i * offset}) for i in range(scale)], ignore_index=True)
+
+
+def create_local_engine(csv_dir="./bike-store-data", path=None, scale=1):
+    """
+    Loads every CSV file of a directory into a SQLite database, one table per file.
+    Used to run offline checks and benchmarks without a Postgres server.
+
+    :param csv_dir: Directory containing the CSV files.
+    :param path: SQLite file to create. None keeps the database in memory.
+    :param scale: Replicates orders and order items this many times to get a bigger dataset.
+    :return: SQLAlchemy engine connected to the database.
+    """
+    if path:
+        engine = create_engine(f"sqlite:///{path}")
+    else:
+        # A single shared connection, otherwise each connection gets its own empty database
+        engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+
+    for file_path in sorted(glob.glob(os.path.join(csv_dir, "*.csv"))):
+        table_name = os.path.splitext(os.path.basename(file_path))[0]
+        df = scale_frame(pd.read_csv(file_path), scale)
+        df.to_sql(table_name, engine, if_exists="replace", index=False)
+
+    return engine
@@ -0,0 +1,63 @@
+import ast
+
+FIELDS = {"Timestamp": "timestamp", "Question": "question", "SQL Query": "sql_query", "Answer": "answer"}
+# Placeholders written by log_query when no usable SQL was produced
+MISSING_SQL = {"SQL Query not found", "No successful SQL Query generated"}
+# Answers of runs stopped before a final answer (deadline, Ctrl-C, iteration limit): their last
+# query is often exploratory. The second prefix is the raw executor output of older entries.
+STOPPED_ANSWER = "Stopped before a final answer"
+STOPPED_ANSWERS = (STOPPED_ANSWER, "Agent stopped due to")
+
+
+def normalize_sql(sql_query):
+    """
+    Older log entries store the tool input dict ({'query': '...'}) instead of the SQL text.
+    """
+    sql_query = sql_query.strip()
+    if sql_query.startswith("{"):
+        try:
+            value = ast.literal_eval(sql_query)
+            if isinstance(value, dict):
+                return str(value.get("query", "")).strip()
+        except (ValueError, SyntaxError):
+            pass
+    return sql_query
+
+
+def read_query_history(log_file="query_history.txt"):
+    """
+    Parses the log written by log_query() into a list of entries.
+    Fields can span several lines (multi-line SQL, markdown answers).
+
+    :param log_file: Path to the query history file.
+    :return: List of dictionaries with 'timestamp', 'question', 'sql_query' and 'answer'.
+             'sql_query' is None when the agent did not produce a usable query.
+    """
+    entries = []
+    entry, field = {}, None
+
+    with open(log_file) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line == "-" * 50:
+                if entry:
+                    entries.append(entry)
+                entry, field = {}, None
+                continue
+
+            prefix, sep, rest = line.partition(": ")
+            if sep and prefix in FIELDS and (prefix == "Timestamp" or entry):
+                field = FIELDS[prefix]
+                entry[field] = rest
+            elif field:
+                entry[field] += "\n" + line
+
+    if entry:
+        entries.append(entry)
+
+    for entry in entries:
+        for field in FIELDS.values():
+            entry[field] = entry.get(field, "").strip()
+        sql_query = normalize_sql(entry["sql_query"])
+        entry["sql_query"] = None if not sql_query or sql_query in MISSING_SQL else sql_query
+    return entries
@@ -0,0 +1,189 @@
+import io
+import os
+import sys
+import time
+import types
+import pstats
+import cProfile
+import threading
+import contextvars
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+DEFAULT_PROFILE_DIR = "./profiles"
+# Frames kept per allocation, enough to see which library holds the memory
+TRACEMALLOC_FRAMES = 10
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 15
+
+# Not followed when measuring retained sizes: shared by everything, not owned by a session
+_SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                  threading.Lock().__class__, threading.Thread)
+
+
+# Set while a request is profiled. cProfile only sees its own thread, so work usually handed
+# to worker threads (the tools of a streamed answer) runs inline instead, see InlineExecutor.
+profiling = contextvars.ContextVar("profiling", default=False)
+
+
+class InlineExecutor(ThreadPoolExecutor):
+    """
+    Executor running each task in the submitting thread, used as the default executor of
+    the event loop of a profiled request so its tool calls show up in the CPU profile.
+    (asyncio only accepts a ThreadPoolExecutor, it never starts a thread here.)
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+def deep_size(obj):
+    """
+    Approximate bytes retained by an object: itself, its containers and attributes.
+    """
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _SKIPPED_TYPES):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current, 0)
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        elif hasattr(current, "__dict__"):
+            stack.append(current.__dict__)
+    return size
+
+
+def measure_objects(tracked):
+    """
+    {name: {key: (items, bytes)}} for dicts of tracked objects such as the chat history store,
+    so growth can be attributed to one session or cache entry.
+    """
+    sizes = {}
+    for name, container in tracked.items():
+        sizes[name] = {}
+        for key, value in list(container.items()):
+            messages = getattr(value, "messages", None)
+            items = len(messages) if messages is not None else (len(value) if hasattr(value, "__len__") else 1)
+            sizes[name][str(key)] = (items, deep_size(value))
+    return sizes
+
+
+def _package(filename):
+    # site-packages/langchain_core/... -> langchain_core, project files keep their name
+    parts = filename.replace("\\", "/").split("/")
+    if "site-packages" in parts:
+        index = parts.index("site-packages")
+        return parts[index + 1] if index + 1 < len(parts) else filename
+    return os.path.basename(filename)
+
+
+class RequestProfiler:
+    """
+    Opt-in profiling of single requests: cProfile for CPU, tracemalloc for allocations,
+    and the growth of tracked objects (chat histories, caches).
+
+    A request is profiled when run() is called with profile=True or every `every` requests.
+    Otherwise run() only increments a counter before calling the function.
+    Each profiled request writes <directory>/request-<time>-<n>.prof (open with pstats or snakeviz)
+    and a .txt report.
+
+    cProfile only sees the thread it runs in: while profiling, the `profiling` context variable
+    is set so streamed answers run their tools inline (agent_stream.stream_answer()).
+    """
+
+    def __init__(self, every=0, directory=DEFAULT_PROFILE_DIR, tracked=None):
+        self.every = every
+        self.directory = directory
+        self.tracked = tracked or {}
+        self.requests = 0
+        # tracemalloc is process-wide, one profiled request at a time
+        self._lock = threading.Lock()
+
+    def run(self, function, *args, profile=False, **kwargs):
+        """
+        Calls function, profiled when profile=True (a request asking for it) or every `every` requests.
+        """
+        self.requests += 1
+        if not (profile or (self.every and self.requests % self.every == 0)):
+            return function(*args, **kwargs)
+        if not self._lock.acquire(blocking=False):
+            return function(*args, **kwargs)
+        try:
+            return self._profile(function, args, kwargs)
+        finally:
+            self._lock.release()
+
+    def _profile(self, function, args, kwargs):
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        objects_before = measure_objects(self.tracked)
+        memory_before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        token = profiling.set(True)
+        try:
+            profiler.enable()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.disable()
+        finally:
+            profiling.reset(token)
+            elapsed = time.perf_counter() - start
+            memory_after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started_tracing:
+                tracemalloc.stop()
+            self._write(profiler, elapsed, memory_before, memory_after, peak,
+                        objects_before, measure_objects(self.tracked))
+
+    def _write(self, profiler, elapsed, memory_before, memory_after, peak, objects_before, objects_after):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"request-{time.strftime('%Y%m%d-%H%M%S')}-{self.requests}")
+        profiler.dump_stats(f"{base}.prof")
+
+        report = io.StringIO()
+        report.write(f"Request {self.requests}: {elapsed:.3f}s, traced memory peak {peak / 1024 / 1024:.1f} MB\n")
+
+        report.write("\nRetained memory growth by package:\n")
+        differences = memory_after.compare_to(memory_before, "filename")
+        by_package = defaultdict(int)
+        for difference in differences:
+            by_package[_package(difference.traceback[0].filename)] += difference.size_diff
+        for package, growth in sorted(by_package.items(), key=lambda item: -item[1])[:TOP_ALLOCATIONS]:
+            report.write(f"  {growth / 1024:+10.1f} KB  {package}\n")
+
+        report.write("\nTop allocation sites:\n")
+        for difference in memory_after.compare_to(memory_before, "lineno")[:TOP_ALLOCATIONS]:
+            report.write(f"  {difference}\n")
+
+        for name, after in objects_after.items():
+            before = objects_before.get(name, {})
+            report.write(f"\n{name}: {len(after)} entries, {sum(size for _, size in after.values()) / 1024:.1f} KB\n")
+            for key, (items, size) in sorted(after.items(), key=lambda item: -item[1][1]):
+                old_items, old_size = before.get(key, (0, 0))
+                report.write(f"  {key}: {items} items ({items - old_items:+d}), "
+                             f"{size / 1024:.1f} KB ({(size - old_size) / 1024:+.1f} KB)\n")
+
+        report.write(f"\nCPU profile (top {TOP_FUNCTIONS} by cumulative time):\n")
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+
+        with open(f"{base}.txt", "w") as f:
+            f.write(report.getvalue())
+        print(f"(Profile written to {base}.prof and {base}.txt)")
+        return base
@@ -94,6 +94,42 @@ bike_store_metadata = {
     """
 }
 
+# Precomputed summary tables maintained by aggregates.refresh_aggregates().
+# Only added to the prompt when the tables exist in the database.
+bike_store_aggregate_metadata = {
+    "agg_order_revenue": """
+    PRECOMPUTED summary: one row per order with its realized revenue. PREFER it over joining orders and order_items.
+    Columns:
+    - order_id (Integer): Primary Key, references orders.
+    - customer_id, store_id, staff_id (Integer): Copied from orders.
+    - order_status (Integer): 1=Pending, 2=Processing, 3=Rejected, 4=Completed.
+    - order_date (Date): When the order was placed.
+    - items_sold (Integer): Total quantity of the order.
+    - revenue (Decimal): SUM(quantity * list_price * (1 - discount)) of the order lines (discount already applied).
+    """,
+
+    "agg_store_daily_revenue": """
+    PRECOMPUTED summary: revenue per store, day and order status. PREFER it for revenue by store or over time.
+    Columns:
+    - store_id (Integer): Foreign Key referencing stores.
+    - order_date (Date): Day of the orders.
+    - order_status (Integer): 1=Pending, 2=Processing, 3=Rejected, 4=Completed.
+    - orders (Integer): Number of orders.
+    - items_sold (Integer): Total quantity sold.
+    - revenue (Decimal): Realized revenue (discount already applied).
+    """,
+
+    "agg_product_sales": """
+    PRECOMPUTED summary: sales per product and order status. PREFER it for best-selling products, brands or categories.
+    Columns:
+    - product_id (Integer): Foreign Key referencing products (join products for brand_id / category_id).
+    - order_status (Integer): 1=Pending, 2=Processing, 3=Rejected, 4=Completed.
+    - orders (Integer): Number of orders containing the product.
+    - quantity_sold (Integer): Total quantity sold.
+    - revenue (Decimal): Realized revenue (discount already applied).
+    """
+}
+
 bank_metadata = {
     "transactions": """
     Stores daily transaction summaries for the REC-SSEC Bank across various regions and domains.
@@ -0,0 +1,265 @@
+import os
+import json
+import hashlib
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+
+# Number of rows read per table. Large tables are sampled so profiling stays bounded.
+DEFAULT_SAMPLE_ROWS = 10000
+# Columns with at most this many distinct values get their top values listed
+LOW_CARDINALITY_LIMIT = 20
+TOP_VALUES = 10
+DEFAULT_CACHE_FILE = "schema_profile_cache.json"
+ISO_DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}"
+# Random ordering function of the dialects without TABLESAMPLE, used to sample big tables
+RANDOM_ORDER = {"sqlite": "RANDOM()", "mysql": "RAND()", "mariadb": "RAND()"}
+# How the rows of a profile were read: the whole table, a random sample, or only its first rows
+SAMPLE_FULL, SAMPLE_RANDOM, SAMPLE_FIRST = "full", "random", "first"
+
+
+def estimate_row_count(engine, table):
+    """
+    Returns a cheap estimate of the number of rows in a table, or None when there is none.
+
+    No database scans the table: Postgres reads the planner statistics in pg_class, MySQL the
+    table statistics of information_schema and SQLite the largest rowid (one B-tree descent,
+    exact as long as no rows were deleted).
+    """
+    quoted = engine.dialect.identifier_preparer.quote(table)
+    dialect = engine.dialect.name
+    with engine.connect() as conn:
+        if dialect == "postgresql":
+            rows = conn.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:t)"),
+                {"t": quoted},
+            ).scalar()
+            # reltuples is -1 when the table has never been analyzed
+            if rows is not None and rows >= 0:
+                return int(rows)
+            return None
+        if dialect in ("mysql", "mariadb"):
+            rows = conn.execute(
+                text("SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :t"),
+                {"t": table},
+            ).scalar()
+            return int(rows) if rows is not None else None
+        if dialect == "sqlite":
+            try:
+                rows = conn.execute(text(f"SELECT MAX(rowid) FROM {quoted}")).scalar()
+            except DBAPIError:
+                # WITHOUT ROWID table
+                return None
+            return int(rows or 0)
+        return None
+
+
+def table_fingerprint(columns, row_estimate, method=None):
+    """
+    Builds a cache key from the table layout, its approximate size and the sampling method.
+    The row count is rounded to two significant digits so small changes keep the cache warm.
+    """
+    if row_estimate:
+        digits = len(str(row_estimate))
+        row_estimate = round(row_estimate, -max(digits - 2, 0))
+    payload = json.dumps({"columns": columns, "rows": row_estimate, "sample": method}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def _to_json_value(value):
+    # Convert numpy / pandas scalars into plain JSON values
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, (int, float, str, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def sample_method(engine, row_estimate, sample_rows=DEFAULT_SAMPLE_ROWS):
+    """
+    How sample_table() reads a table: SAMPLE_FULL when it fits in `sample_rows`, SAMPLE_RANDOM
+    when the dialect can sample, SAMPLE_FIRST (the first `sample_rows` rows) otherwise.
+    """
+    if row_estimate is not None and row_estimate <= sample_rows:
+        return SAMPLE_FULL
+    if engine.dialect.name == "postgresql" and row_estimate:
+        return SAMPLE_RANDOM
+    if engine.dialect.name in RANDOM_ORDER:
+        return SAMPLE_RANDOM
+    return SAMPLE_FIRST
+
+
+def sample_table(engine, table, row_estimate, sample_rows=DEFAULT_SAMPLE_ROWS):
+    """
+    Reads at most `sample_rows` rows of a table in a single query.
+    On Postgres, big tables use TABLESAMPLE SYSTEM so only a fraction of the pages is read.
+    SQLite and MySQL pick random rows, other databases return the first rows.
+    """
+    quoted = engine.dialect.identifier_preparer.quote(table)
+    query = f"SELECT * FROM {quoted}"
+    method = sample_method(engine, row_estimate, sample_rows)
+    if method == SAMPLE_RANDOM and engine.dialect.name == "postgresql":
+        # Oversample a little, block sampling returns a variable number of rows
+        percent = min(100.0, 200.0 * sample_rows / row_estimate)
+        query += f" TABLESAMPLE SYSTEM ({percent:.4f})"
+    elif method == SAMPLE_RANDOM:
+        query += f" ORDER BY {RANDOM_ORDER[engine.dialect.name]}"
+    query += f" LIMIT {int(sample_rows)}"
+
+    with engine.connect() as conn:
+        return pd.read_sql(text(query), conn)
+
+
+def profile_column(series, sql_type):
+    """
+    Computes the statistics of one sampled column.
+    """
+    non_null = series.dropna()
+    stats = {
+        "type": sql_type,
+        "null_frac": round(float(series.isna().mean()), 4) if len(series) else 0.0,
+        "distinct": int(non_null.nunique()),
+        "unique": bool(len(non_null) > 0 and non_null.is_unique),
+    }
+
+    is_numeric = pd.api.types.is_numeric_dtype(non_null) and not pd.api.types.is_bool_dtype(non_null)
+    # Dates loaded from CSV are often stored as ISO text, their range is still useful
+    is_iso_date = (
+        len(non_null) > 0
+        and (pd.api.types.is_object_dtype(non_null) or pd.api.types.is_string_dtype(non_null))
+        and non_null.astype(str).str.match(ISO_DATE_PATTERN).all()
+    )
+    if len(non_null) and (is_numeric or is_iso_date or pd.api.types.is_datetime64_any_dtype(non_null)):
+        stats["min"] = _to_json_value(non_null.min())
+        stats["max"] = _to_json_value(non_null.max())
+
+    # Unique numbers are identifiers, listing them does not help the model
+    if 0 < stats["distinct"] <= LOW_CARDINALITY_LIMIT and not (stats["unique"] and is_numeric):
+        counts = non_null.value_counts().head(TOP_VALUES)
+        stats["top_values"] = [[_to_json_value(v), int(c)] for v, c in counts.items()]
+
+    return stats
+
+
+def profile_table(engine, table, sample_rows=DEFAULT_SAMPLE_ROWS, columns=None, row_estimate=None):
+    """
+    Profiles one table: column types, null fraction, distinct counts, min/max
+    and the top values of low-cardinality columns.
+    """
+    if columns is None:
+        columns = [(c["name"], str(c["type"])) for c in inspect(engine).get_columns(table)]
+    df = sample_table(engine, table, row_estimate, sample_rows)
+    method = sample_method(engine, row_estimate, sample_rows)
+    if method == SAMPLE_FIRST and len(df) < sample_rows:
+        # Fewer rows than asked for: the whole table was read
+        method = SAMPLE_FULL
+
+    profiled = {name: profile_column(df[name], sql_type) for name, sql_type in columns if name in df}
+    if method == SAMPLE_FIRST:
+        # The first rows are usually the oldest ones, their min / max say nothing of the table
+        for stats in profiled.values():
+            stats.pop("min", None)
+            stats.pop("max", None)
+
+    return {
+        "row_estimate": row_estimate,
+        "sampled_rows": len(df),
+        "sample": method,
+        "columns": profiled,
+    }
+
+
+def _load_cache(cache_file):
+    if not cache_file or not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache, cache_file):
+    if not cache_file:
+        return
+    with open(cache_file, "w") as f:
+        json.dump(cache, f, indent=2)
+
+
+def profile_database(engine, tables=None, cache_file=DEFAULT_CACHE_FILE, sample_rows=DEFAULT_SAMPLE_ROWS):
+    """
+    Profiles every table, reusing cached profiles whose fingerprint still matches.
+
+    :param engine: SQLAlchemy engine of the database to profile.
+    :param tables: Table names to profile. Defaults to every table in the database.
+    :param cache_file: JSON file used to cache profiles. None disables caching.
+    :param sample_rows: Maximum number of rows read per table.
+    :return: Dictionary {table_name: profile}.
+    """
+    inspector = inspect(engine)
+    if tables is None:
+        tables = inspector.get_table_names()
+
+    # Cache entries are grouped per database so several databases can share a file
+    cache = _load_cache(cache_file)
+    db_key = engine.url.render_as_string(hide_password=True)
+    db_cache = cache.setdefault(db_key, {})
+
+    profiles = {}
+    changed = False
+    for table in tables:
+        columns = [(c["name"], str(c["type"])) for c in inspector.get_columns(table)]
+        row_estimate = estimate_row_count(engine, table)
+        fingerprint = table_fingerprint(columns, row_estimate, sample_method(engine, row_estimate, sample_rows))
+
+        cached = db_cache.get(table)
+        if cached and cached.get("fingerprint") == fingerprint:
+            profiles[table] = cached["profile"]
+            continue
+
+        profile = profile_table(engine, table, sample_rows, columns, row_estimate)
+        db_cache[table] = {"fingerprint": fingerprint, "profile": profile}
+        profiles[table] = profile
+        changed = True
+
+    if changed:
+        _save_cache(cache, cache_file)
+    return profiles
+
+
+def format_profile(profile):
+    """
+    Renders a table profile as text for the system prompt.
+    Curly braces are escaped because the result ends up in a prompt template.
+    """
+    sampled = profile["sampled_rows"]
+    total = profile.get("row_estimate")
+    if profile.get("sample") == SAMPLE_FIRST:
+        header = f"Column statistics (first {sampled} rows only, not representative of the whole table):"
+    elif total:
+        header = f"Column statistics (sampled {sampled} of ~{total} rows):"
+    else:
+        header = f"Column statistics ({sampled} sampled rows):"
+    lines = [header]
+
+    for name, stats in profile["columns"].items():
+        parts = [f"nulls {stats['null_frac']:.0%}"]
+        if stats["unique"] and stats["distinct"] > LOW_CARDINALITY_LIMIT:
+            parts.append("all values unique")
+        else:
+            parts.append(f"{stats['distinct']} distinct")
+        if "min" in stats:
+            parts.append(f"range {stats['min']} .. {stats['max']}")
+        if "top_values" in stats:
+            if stats["unique"]:
+                values = ", ".join(repr(value) for value, _ in stats["top_values"])
+            else:
+                values = ", ".join(f"{value!r} ({count})" for value, count in stats["top_values"])
+            parts.append(f"values: {values}")
+        lines.append(f"- {name} ({stats['type']}): " + "; ".join(parts))
+
+    return "\n".join(lines).replace("{", "{{").replace("}", "}}")
+
+
+def format_profiles(profiles):
+    return {table: format_profile(profile) for table, profile in profiles.items()}
@@ -0,0 +1,283 @@
+import re
+import time
+import threading
+from collections import OrderedDict, defaultdict, namedtuple
+from sqlalchemy.exc import SQLAlchemyError
+from langchain_community.utilities.sql_database import truncate_word
+from deadlines import current_deadline
+
+# Prepared statements kept per Postgres connection, the least recently used are deallocated
+MAX_PREPARED_STATEMENTS = 64
+# Type names whose literal must stay in the text: DATE '2018-01-01', INTERVAL '1 day', NUMERIC(10, 2)
+TYPE_WORDS = {"date", "time", "timestamp", "interval", "decimal", "numeric", "varchar", "char", "character"}
+# Errors of a statement that only fails once parameterized (a parameter type the server cannot
+# infer, an expression no longer matching its GROUP BY), the plain text is then run instead
+PARAMETER_ERROR_PATTERN = re.compile(
+    r"could not determine data type of parameter|inconsistent types deduced for parameter"
+    r"|must appear in the GROUP BY clause|is not unique|does not exist: .*\bunknown\b"
+    r"|invalid input syntax for type",
+    re.I,
+)
+# Words ending an ORDER BY / GROUP BY list, in which numbers are column positions
+CLAUSE_WORDS = {"limit", "offset", "having", "union", "intersect", "except", "fetch", "window",
+                "select", "from", "where", "for"}
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*"|`[^`]*`)
+  | (?P<number>(?<![\w.$])\d+(?:\.\d+)?(?:[eE][-+]?\d+)?(?![\w.]))
+  | (?P<word>[A-Za-z_][\w$]*)
+  | (?P<space>\s+)
+  | (?P<other>.)
+""", re.S | re.X)
+
+
+class Fingerprint(namedtuple("Fingerprint", ["parts", "params"])):
+    """
+    A query with its literals pulled out: parts are the text between the literals, params their values.
+    Queries of the same shape share the key, whatever their literals.
+    """
+
+    @property
+    def key(self):
+        return "?".join(self.parts)
+
+    def numbered(self):
+        # Postgres placeholders: $1, $2, ...
+        text = self.parts[0]
+        for position, part in enumerate(self.parts[1:], 1):
+            text += f"${position}{part}"
+        return text
+
+
+def _literal(token, kind):
+    if kind == "string":
+        return token[1:-1].replace("''", "'")
+    return int(token)
+
+
+def _is_decimal(token):
+    return any(c in token for c in ".eE")
+
+
+def fingerprint(query):
+    """
+    Splits a SELECT into its shape and its literals:
+    "SELECT * FROM orders WHERE order_status = 4 LIMIT 10" ->
+    parts ["SELECT * FROM orders WHERE order_status = ", " LIMIT ", ""], params [4, 10].
+
+    Literals that are part of the syntax stay in the text: typed literals (DATE '...'),
+    type modifiers (NUMERIC(10, 2)) and column positions (ORDER BY 2). Decimal literals stay too:
+    Postgres types a parameter after the other operand, so 0.5 in quantity * $1 would become 1.
+    Returns None for statements that are not queries.
+    """
+    parts, params, current = [], [], []
+    previous = None            # previous significant token, lowercase
+    position_list = False      # inside ORDER BY / GROUP BY
+    type_depth = 0             # inside the parentheses of a type name
+
+    for match in TOKEN_PATTERN.finditer(query.strip().rstrip(";")):
+        kind, token = match.lastgroup, match.group()
+        if kind == "comment":
+            continue
+        if kind == "space":
+            if previous is not None and (not current or current[-1] != " "):
+                current.append(" ")
+            continue
+
+        if previous is None and (kind != "word" or token.lower() not in ("select", "with")):
+            return None
+
+        keep = (
+            type_depth > 0
+            or (kind == "string" and previous in TYPE_WORDS)
+            or (kind == "number" and position_list and previous in ("by", ","))
+            or (kind == "number" and _is_decimal(token))
+        )
+        if kind in ("string", "number") and not keep:
+            parts.append("".join(current))
+            params.append(_literal(token, kind))
+            current = []
+        else:
+            current.append(token)
+
+        lowered = token.lower()
+        if kind == "word":
+            if lowered == "by" and previous in ("order", "group"):
+                position_list = True
+            elif lowered in CLAUSE_WORDS:
+                position_list = False
+        elif token == "(":
+            if type_depth or previous in TYPE_WORDS:
+                type_depth += 1
+            elif position_list:
+                position_list = False
+        elif token == ")" and type_depth:
+            type_depth -= 1
+        previous = lowered
+
+    parts.append("".join(current).rstrip())
+    return Fingerprint(parts, params)
+
+
+class QueryStats:
+    """
+    Executions and latency per query shape, to see which shapes are hot.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.shapes = defaultdict(lambda: {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "prepared": 0})
+
+    def record(self, key, elapsed, error=False, prepared=False):
+        milliseconds = elapsed * 1000
+        with self.lock:
+            shape = self.shapes[key]
+            shape["count"] += 1
+            shape["errors"] += int(error)
+            shape["prepared"] += int(prepared)
+            shape["total_ms"] += milliseconds
+            shape["max_ms"] = max(shape["max_ms"], milliseconds)
+
+    def hot(self, limit=10):
+        """
+        The shapes taking the most total time, with their average latency.
+        """
+        with self.lock:
+            shapes = [dict(shape, fingerprint=key) for key, shape in self.shapes.items()]
+        for shape in shapes:
+            shape["avg_ms"] = round(shape["total_ms"] / shape["count"], 3)
+            shape["total_ms"] = round(shape["total_ms"], 3)
+            shape["max_ms"] = round(shape["max_ms"], 3)
+        return sorted(shapes, key=lambda shape: shape["total_ms"], reverse=True)[:limit]
+
+
+class FingerprintingRunner:
+    """
+    Runs queries as their fingerprint plus bind parameters, so each shape is planned once per connection:
+    - Postgres: PREPARE once per connection and shape (kept in the connection's info), then EXECUTE
+    - SQLite: the same parameterized text every time, served from sqlite3's statement cache
+    Other databases, statements that are not queries and shapes the server cannot prepare
+    run as plain text. Other errors are returned as they are, formatted like SQLDatabase.run_no_throw().
+    """
+
+    def __init__(self, db, max_prepared=MAX_PREPARED_STATEMENTS):
+        self.db = db
+        self.max_prepared = max_prepared
+        self.stats = QueryStats()
+        # Shapes the server refused to prepare (e.g. a parameter type it cannot infer)
+        self.unpreparable = set()
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def _statement_name(self, key):
+        with self._lock:
+            if key not in self._names:
+                self._names[key] = f"agent_q{len(self._names)}"
+            return self._names[key]
+
+    def _format(self, rows):
+        rows = [tuple(truncate_word(value, length=self.db._max_string_length) for value in row) for row in rows]
+        return str(rows) if rows else ""
+
+    def _execute_postgres(self, connection, fp):
+        cache = connection.connection.info.setdefault("prepared_statements", OrderedDict())
+        name = self._statement_name(fp.key)
+        if name not in cache:
+            connection.exec_driver_sql(f"PREPARE {name} AS {fp.numbered()}", execution_options={"no_parameters": True})
+            cache[name] = fp.key
+            if len(cache) > self.max_prepared:
+                evicted, _ = cache.popitem(last=False)
+                connection.exec_driver_sql(f"DEALLOCATE {evicted}")
+        cache.move_to_end(name)
+        placeholders = ", ".join(["%s"] * len(fp.params))
+        statement = f"EXECUTE {name} ({placeholders})" if fp.params else f"EXECUTE {name}"
+        return connection.exec_driver_sql(statement, tuple(fp.params))
+
+    def _execute_sqlite(self, connection, fp):
+        return connection.exec_driver_sql(fp.key, tuple(fp.params))
+
+    def run(self, query):
+        """
+        Runs a query and returns its rows as text, or "Error: ..." like SQLDatabase.run_no_throw().
+        """
+        dialect = self.db.dialect
+        fp = fingerprint(query)
+        if fp is None or self.db._schema is not None or dialect not in ("postgresql", "sqlite"):
+            return self._run_text(query, fp)
+
+        if fp.key in self.unpreparable:
+            return self._run_text(query, fp)
+
+        start = time.perf_counter()
+        try:
+            with self.db._engine.begin() as connection:
+                execute = self._execute_postgres if dialect == "postgresql" else self._execute_sqlite
+                result = self._format(execute(connection, fp).fetchall())
+        except SQLAlchemyError as e:
+            deadline = current_deadline.get()
+            # A mistake of the query (unknown column, ...) fails the plain text as well: returned directly.
+            # Interrupted by the request deadline: no time for the plain text either.
+            if not PARAMETER_ERROR_PATTERN.search(str(getattr(e, "orig", None) or e)) or (deadline is not None and deadline.expired()):
+                self.stats.record(fp.key, time.perf_counter() - start, error=True)
+                return f"Error: {e}"
+            # Only fails parameterized: run the plain text, and from now on for this shape if it works
+            result = self._run_text(query, fp)
+            if not result.startswith("Error:"):
+                with self._lock:
+                    self.unpreparable.add(fp.key)
+            return result
+        self.stats.record(fp.key, time.perf_counter() - start, prepared=True)
+        return result
+
+    def _run_text(self, query, fp):
+        start = time.perf_counter()
+        result = self.db.run_no_throw(query)
+        key = fp.key if fp is not None else re.sub(r"\s+", " ", query.strip())
+        self.stats.record(key, time.perf_counter() - start, error=result.startswith("Error:"))
+        return result
+
+
+if __name__ == "__main__":
+    # Repeated workload: the query shapes of questions.txt with changing literals,
+    # sent as plain text (parsed and planned every time) vs fingerprint + parameters.
+    import random
+    from langchain_community.utilities import SQLDatabase
+    from local_db import create_local_engine
+
+    db = SQLDatabase(create_local_engine())
+    stores = ["Santa Cruz Bikes", "Baldwin Bikes", "Rowlett Bikes"]
+    categories = ["Mountain Bikes", "Road Bikes", "Children Bicycles", "Comfort Bicycles", "Electric Bikes"]
+    shapes = [
+        lambda: f"SELECT SUM(s.quantity) FROM stocks s JOIN products p ON p.product_id = s.product_id "
+                f"JOIN categories c ON c.category_id = p.category_id JOIN stores st ON st.store_id = s.store_id "
+                f"WHERE c.category_name = '{random.choice(categories)}' AND st.store_name = '{random.choice(stores)}'",
+        lambda: f"SELECT first_name, last_name, email FROM customers WHERE customer_id = {random.randint(1, 1445)}",
+        lambda: f"SELECT product_name, list_price FROM products WHERE list_price > {random.randint(100, 5000)} "
+                f"ORDER BY list_price DESC LIMIT {random.randint(3, 10)}",
+        lambda: f"SELECT o.order_id, o.order_date FROM orders o JOIN stores s ON s.store_id = o.store_id "
+                f"WHERE s.store_name = '{random.choice(stores)}' AND o.order_status = {random.randint(1, 4)} LIMIT 10",
+    ]
+    random.seed(0)
+    workload = [random.choice(shapes)() for _ in range(4000)]
+
+    runner = FingerprintingRunner(db)
+    # Same results either way
+    assert all(db.run_no_throw(q) == runner.run(q) for q in workload[:50])
+
+    timings = {}
+    for mode, run in (("plain text", db.run_no_throw), ("fingerprinted", runner.run)):
+        start = time.perf_counter()
+        for query in workload:
+            run(query)
+        timings[mode] = time.perf_counter() - start
+        print(f"{mode}: {timings[mode] * 1000 / len(workload):.3f}ms per query")
+    saved = timings["plain text"] - timings["fingerprinted"]
+    # SQLite has no separate planning step: the saving is the statement compilation (parse + plan)
+    # served from sqlite3's cache, plus SQLAlchemy no longer compiling a new text() each time
+    print(f"Saved {saved * 1000 / len(workload):.3f}ms per query ({saved / timings['plain text']:.0%})")
+
+    print("\nHot query shapes:")
+    for shape in runner.stats.hot(5):
+        print(f"  {shape['count']:5d}x  avg {shape['avg_ms']:.3f}ms  {shape['fingerprint'][:90]}")
@@ -0,0 +1,296 @@
+import re
+import difflib
+from sqlalchemy import inspect
+
+# Minimum similarity for a fuzzy identifier match to be applied without asking the LLM
+MATCH_CUTOFF = 0.8
+# A query can contain several wrong identifiers, each one needs its own pass
+MAX_REPAIR_ATTEMPTS = 3
+
+# (kind, pattern) pairs. Group 1 is the qualifier (alias or schema), group 2 the unknown name.
+ERROR_PATTERNS = [
+    # Postgres
+    ("column", re.compile(r'column "?(?:(\w+)\.)?(\w+)"? does not exist', re.I)),
+    ("table", re.compile(r'relation "?(?:(\w+)\.)?(\w+)"? does not exist', re.I)),
+    # SQLite
+    ("column", re.compile(r"no such column: (?:(\w+)\.)?(\w+)", re.I)),
+    ("table", re.compile(r"no such table: (?:(\w+)\.)?(\w+)", re.I)),
+    # MySQL
+    ("column", re.compile(r"Unknown column '(?:(\w+)\.)?(\w+)'", re.I)),
+    ("table", re.compile(r"Table '(?:(\w+)\.)?(\w+)' doesn't exist", re.I)),
+]
+
+# Words that can follow a table name in FROM / JOIN and must not be read as an alias
+CLAUSE_KEYWORDS = (
+    "ON|USING|WHERE|JOIN|INNER|LEFT|RIGHT|FULL|CROSS|NATURAL|OUTER|GROUP|ORDER|"
+    "LIMIT|HAVING|UNION|EXCEPT|INTERSECT|OFFSET|WINDOW|TABLESAMPLE"
+)
+TABLE_REF_PATTERN = re.compile(
+    rf'\b(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?(?!(?:{CLAUSE_KEYWORDS})\b)(\w+))?',
+    re.I,
+)
+STRING_LITERAL_PATTERN = re.compile(r"('(?:[^']|'')*')")
+
+
+def is_error(result):
+    # SQLDatabase.run_no_throw returns errors as strings instead of raising
+    return isinstance(result, str) and result.startswith("Error:")
+
+
+def get_catalog(db):
+    """
+    Returns {table_name: [column names]} for the tables the agent can use.
+    """
+    inspector = inspect(db._engine)
+    return {
+        table: [c["name"] for c in inspector.get_columns(table)]
+        for table in db.get_usable_table_names()
+    }
+
+
+def parse_error(error):
+    """
+    Extracts the unknown identifier from a database error message.
+
+    :return: Tuple (kind, qualifier, name) where kind is 'table' or 'column', or None.
+    """
+    for kind, pattern in ERROR_PATTERNS:
+        match = pattern.search(error)
+        if match:
+            return kind, match.group(1), match.group(2)
+    return None
+
+
+def singular(table):
+    if table.endswith("ies"):
+        return table[:-3] + "y"
+    if table.endswith("s"):
+        return table[:-1]
+    return table
+
+
+def _substitute(sql, pattern, replacement):
+    # Only rewrite outside of string literals so values like 'name' are left alone
+    parts = STRING_LITERAL_PATTERN.split(sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = pattern.sub(replacement, parts[i])
+    return "".join(parts)
+
+
+def table_references(sql):
+    """
+    Returns the tables used in FROM / JOIN clauses as a list of (table, alias, end offset).
+    The alias is None when the table is not aliased.
+    """
+    return [(m.group(1), m.group(2), m.end()) for m in TABLE_REF_PATTERN.finditer(sql)]
+
+
+def _unique(candidates):
+    # A repair is only confident when exactly one candidate is left
+    candidates = list(dict.fromkeys(candidates))
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def _match_table(name, catalog):
+    tables = list(catalog)
+    lowered = {t.lower(): t for t in tables}
+    if name.lower() in lowered:
+        return lowered[name.lower()]
+
+    plural_forms = [t for t in tables if singular(t).lower() == name.lower() or singular(name).lower() == t.lower()]
+    if plural_forms:
+        return _unique(plural_forms)
+
+    return _unique(difflib.get_close_matches(name, tables, n=1, cutoff=MATCH_CUTOFF))
+
+
+def repair_table(sql, name, catalog, quote):
+    """
+    Replaces an unknown table name with the closest table of the catalog.
+    """
+    table = _match_table(name, catalog)
+    if table is None:
+        return None
+
+    new_name = quote(table)
+    sql = _substitute(sql, re.compile(rf'\b(FROM|JOIN)(\s+)"?{re.escape(name)}"?(?!\w)', re.I), rf"\1\2{new_name}")
+    # Columns qualified with the unaliased table name
+    return _substitute(sql, re.compile(rf'(?<![\w."]){re.escape(name)}\.', re.I), f"{new_name}.")
+
+
+def _label_column(table, columns):
+    # The human readable column of a lookup table, e.g. brands.brand_name
+    for candidate in (f"{singular(table)}_name", "name"):
+        if candidate in columns:
+            return candidate
+    names = [c for c in columns if c.endswith("_name")]
+    return names[0] if len(names) == 1 else None
+
+
+def _column_candidates(column, tables, catalog):
+    """
+    Finds the columns an unknown column most likely refers to, from the most to the least
+    certain rule. Returns (table, column, lookup_table) tuples of the first rule that matched.
+    """
+    lowered = column.lower()
+
+    # 1. Wrong case, e.g. transaction_count -> "Transaction_count"
+    exact = [(t, c, None) for t in tables for c in catalog[t] if c.lower() == lowered]
+    if exact:
+        return exact
+
+    # 2. Name missing the table prefix, e.g. brands.name -> brands.brand_name
+    prefixed = [(t, f"{singular(t)}_{lowered}", None) for t in tables if f"{singular(t)}_{lowered}" in catalog[t]]
+    if prefixed:
+        return prefixed
+
+    # 3. Entity stored in another table, e.g. products.brand -> join brands via brand_id
+    lookups = []
+    for t in tables:
+        if f"{lowered}_id" not in catalog[t]:
+            continue
+        for other in catalog:
+            if other != t and lowered in (other.lower(), singular(other).lower()) and f"{lowered}_id" in catalog[other]:
+                label = _label_column(other, catalog[other])
+                if label:
+                    lookups.append((t, label, other))
+    if lookups:
+        return lookups
+
+    # 4. Close spelling, e.g. order_stauts -> order_status. An entity name is not a misspelled
+    # key: staffs.manager -> manager_id would compare a name with an id (a self join is needed)
+    fuzzy = []
+    for t in tables:
+        for match in difflib.get_close_matches(column, catalog[t], n=2, cutoff=MATCH_CUTOFF):
+            if match.lower().endswith("_id") and not lowered.endswith("_id"):
+                continue
+            fuzzy.append((t, match, None))
+    return fuzzy
+
+
+def repair_column(sql, qualifier, column, catalog, quote):
+    """
+    Replaces an unknown column with its closest match in the tables used by the query.
+    When the value lives in a lookup table, the lookup table is joined on its id column.
+    """
+    references = table_references(sql)
+    aliases = {}
+    for table, alias, _ in references:
+        if table in catalog:
+            aliases[(alias or table).lower()] = table
+            aliases.setdefault(table.lower(), table)
+
+    if qualifier:
+        table = aliases.get(qualifier.lower())
+        tables = [table] if table else []
+    else:
+        tables = list(dict.fromkeys(aliases.values()))
+    if not tables:
+        return None
+
+    match = _unique(_column_candidates(column, tables, catalog))
+    if match is None:
+        return None
+    table, new_column, lookup = match
+
+    if qualifier:
+        pattern = re.compile(rf'(?<![\w."]){re.escape(qualifier)}\s*\.\s*"?{re.escape(column)}"?(?![\w"])', re.I)
+    else:
+        pattern = re.compile(rf'(?<![\w."])"?{re.escape(column)}"?(?![\w"(])', re.I)
+
+    if lookup is None:
+        prefix = f"{qualifier}." if qualifier else ""
+        return _substitute(sql, pattern, f"{prefix}{quote(new_column)}")
+
+    # The lookup table is already joined, only the column reference is wrong
+    joined = [alias or name for name, alias, _ in references if name == lookup]
+    if joined:
+        return _substitute(sql, pattern, f"{joined[0]}.{quote(new_column)}")
+
+    # Join the lookup table right after the reference of the table that holds the id. A LEFT JOIN
+    # keeps the rows with a NULL or dangling id, the repair only swaps the column
+    source = next((r for r in references if r[0] == table), None)
+    if source is None:
+        return None
+    source_name = source[1] or source[0]
+    join_column = f"{column.lower()}_id"
+    join = f" LEFT JOIN {quote(lookup)} ON {quote(lookup)}.{join_column} = {source_name}.{join_column}"
+
+    sql = sql[:source[2]] + join + sql[source[2]:]
+    return _substitute(sql, pattern, f"{quote(lookup)}.{quote(new_column)}")
+
+
+def explain_error(db, sql):
+    """
+    Validates a statement with EXPLAIN so it is planned but not executed.
+    Returns the error message, or None when the statement is valid.
+    """
+    result = db.run_no_throw(f"EXPLAIN {sql}")
+    return result if is_error(result) else None
+
+
+def repair_query(db, query, error, catalog=None):
+    """
+    Tries to fix a failing query locally instead of sending the error back to the LLM.
+
+    :param db: SQLDatabase the query failed on.
+    :param query: The failing SQL statement.
+    :param error: The error message returned by the database.
+    :param catalog: Optional {table: [columns]} mapping from get_catalog(), reflected from the database
+        when missing. Callers repairing several queries should reflect it once and pass it in.
+    :return: The repaired SQL, validated with EXPLAIN, or None when no confident repair exists.
+    """
+    catalog = catalog or get_catalog(db)
+    quote = db._engine.dialect.identifier_preparer.quote
+    sql = query
+
+    for _ in range(MAX_REPAIR_ATTEMPTS):
+        problem = parse_error(error)
+        if problem is None:
+            return None
+
+        kind, qualifier, name = problem
+        if kind == "table":
+            repaired = repair_table(sql, name, catalog, quote)
+        else:
+            repaired = repair_column(sql, qualifier, name, catalog, quote)
+        if repaired is None or repaired == sql:
+            return None
+
+        sql = repaired
+        error = explain_error(db, sql)
+        if error is None:
+            return sql
+
+    return None
+
+
+if __name__ == "__main__":
+    # Replays the recorded history against a local copy of the bike store data and reports
+    # how many failing queries are repaired locally, i.e. how many LLM round-trips are saved.
+    from langchain_community.utilities import SQLDatabase
+    from local_db import create_local_engine
+    from query_log import read_query_history
+
+    db = SQLDatabase(create_local_engine())
+    catalog = get_catalog(db)
+    entries = [e for e in read_query_history() if e["sql_query"]]
+
+    failed, repaired = 0, 0
+    for entry in entries:
+        result = db.run_no_throw(entry["sql_query"])
+        if not is_error(result):
+            continue
+        failed += 1
+        fixed = repair_query(db, entry["sql_query"], result, catalog)
+        print(f"\nQuestion: {entry['question']}")
+        print(f"Failed SQL: {entry['sql_query']}")
+        print(f"Error: {result.splitlines()[0][:150]}")
+        if fixed:
+            repaired += 1
+            print(f"Repaired SQL: {fixed}")
+        else:
+            print("No confident repair, falling back to the LLM")
+
+    print(f"\nReplayed {len(entries)} logged queries: {failed} failed, {repaired} repaired locally.")
+    print(f"LLM round-trips saved: {repaired}")
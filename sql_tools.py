@@ -0,0 +1,112 @@
+from typing import Any, Optional, Type
+from pydantic import BaseModel, Field
+from langchain_core.tools import BaseTool
+from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
+from sql_repair import get_catalog, is_error, repair_query
+from deadlines import current_deadline, DeadlineExceeded
+from sql_fingerprint import FingerprintingRunner
+
+# Prefix of the tool output when the query only succeeded after a local repair
+REPAIR_NOTE = "Note: the query failed and was automatically repaired to: "
+REPAIR_RESULT = "\nResult: "
+
+
+class RepairingQuerySQLDatabaseTool(QuerySQLDatabaseTool):
+    """
+    sql_db_query tool that fixes unknown table / column names locally.
+    The LLM only sees the original error when no confident repair exists.
+    With a runner, queries run as fingerprint + bind parameters (sql_fingerprint.py).
+    The catalog used by the repairs is reflected on the first failing query, then reused.
+    """
+
+    runner: Optional[FingerprintingRunner] = None
+    catalog: Optional[dict] = None
+
+    def _execute(self, query):
+        try:
+            return self.runner.run(query) if self.runner else self.db.run_no_throw(query)
+        except DeadlineExceeded as e:
+            # Returned as an observation, the executor then stops on the expired deadline
+            return f"Error: {e}"
+
+    def _run(self, query, run_manager=None):
+        result = self._execute(query)
+        if not is_error(result):
+            return result
+
+        # Interrupted by the request deadline: no time left for a repair
+        deadline = current_deadline.get()
+        if deadline is not None and deadline.expired():
+            return result
+
+        if self.catalog is None:
+            self.catalog = get_catalog(self.db)
+        repaired = repair_query(self.db, query, result, self.catalog)
+        if repaired is None:
+            return result
+
+        repaired_result = self._execute(repaired)
+        if is_error(repaired_result):
+            return result
+        return f"{REPAIR_NOTE}{repaired}{REPAIR_RESULT}{repaired_result}"
+
+
+class AgentSQLDatabaseToolkit(SQLDatabaseToolkit):
+    """
+    Standard SQL toolkit with sql_db_query replaced by RepairingQuerySQLDatabaseTool.
+    Set fingerprinting=True to run the queries as fingerprint + bind parameters.
+    """
+
+    fingerprinting: bool = False
+
+    def get_tools(self):
+        runner = FingerprintingRunner(self.db) if self.fingerprinting else None
+        tools = []
+        for tool in super().get_tools():
+            if isinstance(tool, QuerySQLDatabaseTool):
+                tool = RepairingQuerySQLDatabaseTool(db=self.db, description=tool.description, runner=runner)
+            tools.append(tool)
+        return tools
+
+
+class _JoinPathToolInput(BaseModel):
+    table_names: str = Field(
+        ...,
+        description="A comma-separated list of the tables the question needs. Example input: 'stocks, categories, stores'",
+    )
+
+
+class JoinPathTool(BaseTool):
+    """
+    Answers with the shortest join path between tables, from a join_graph.JoinGraph.
+    """
+
+    name: str = "sql_db_join_path"
+    description: str = """
+    Input is a comma-separated list of tables, output is the FROM / JOIN clause connecting them
+    through their foreign keys (with the intermediate tables needed), plus the self joins they offer.
+    Use it before writing a query on two or more tables instead of guessing the join conditions.
+    """
+    args_schema: Type[BaseModel] = _JoinPathToolInput
+    graph: Any = Field(exclude=True)
+
+    def _run(self, table_names, run_manager=None):
+        tables = [name.strip().strip('"') for name in table_names.split(",") if name.strip()]
+        if not tables:
+            return "Error: no table given"
+        return self.graph.format_join_path(tables)
+
+
+def executed_query(tool_input, observation):
+    """
+    Returns the SQL that actually produced an sql_db_query observation,
+    taking local repairs into account.
+    """
+    if isinstance(observation, str) and observation.startswith(REPAIR_NOTE):
+        return observation[len(REPAIR_NOTE):].partition(REPAIR_RESULT)[0]
+
+    # Handle both string and dictionary inputs
+    if isinstance(tool_input, dict):
+        return tool_input.get('query', str(tool_input))
+    return str(tool_input)
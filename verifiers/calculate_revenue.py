@@ -1,33 +1,33 @@
+import numpy as np
+from snapshot import load_snapshot, group_sum
 
-import pandas as pd
 
-# Load data
-stores_df = pd.read_csv('./bike-store-data/stores.csv')
-orders_df = pd.read_csv('./bike-store-data/orders.csv')
-items_df = pd.read_csv('./bike-store-data/order_items.csv')
+def store_revenue(snap, order_status=4):
+    """
+    Realized revenue per store, only counting orders with the given status (4 = Completed).
+    Returns [(store_name, revenue)] sorted by revenue descending.
+    """
+    items = snap.table('order_items')
+    stores = snap.table('stores')
 
-# Filter for completed orders (Status 4 = Completed)
-# Based on previous context, status 4 is completed.
-completed_orders = orders_df[orders_df['order_status'] == 4]
+    # Calculate revenue per item
+    revenue = items['quantity'] * items['list_price'] * (1 - items['discount'])
 
-# Calculate revenue per item
-items_df['revenue'] = items_df['quantity'] * items_df['list_price'] * (1 - items_df['discount'])
+    # Store and status of the order of each item, through the precomputed join index
+    status = snap.related('order_items', 'order_id', 'order_status')
+    store_ids = snap.related('order_items', 'order_id', 'store_id')
 
-# Sum revenue per order
-order_revenue = items_df.groupby('order_id')['revenue'].sum().reset_index()
+    # Filter for completed orders and group by store
+    completed = status == order_status
+    keys, totals = group_sum(store_ids[completed], revenue[completed])
 
-# Join orders with revenue
-orders_with_revenue = pd.merge(completed_orders, order_revenue, on='order_id', how='inner')
+    # Join with store names and sort by revenue descending
+    names = np.asarray(stores['store_name'])[stores.lookup(keys)]
+    order = np.argsort(-totals)
+    return [(str(names[i]), float(totals[i])) for i in order]
 
-# Group by store
-store_revenue = orders_with_revenue.groupby('store_id')['revenue'].sum().reset_index()
 
-# Join with store names
-final_df = pd.merge(store_revenue, stores_df[['store_id', 'store_name']], on='store_id')
-
-# Sort by revenue descending
-final_df = final_df.sort_values('revenue', ascending=False)
-
-# Format nicely
-pd.options.display.float_format = '${:,.2f}'.format
-print(final_df[['store_name', 'revenue']])
+if __name__ == "__main__":
+    snap = load_snapshot()
+    for store_name, revenue in store_revenue(snap):
+        print(f"{store_name:<20} ${revenue:,.2f}")
@@ -0,0 +1,250 @@
+import os
+import sys
+import glob
+import json
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from local_db import scale_frame
+
+DEFAULT_CSV_DIR = "./bike-store-data"
+DEFAULT_SNAPSHOT_DIR = "./bike-store-snapshot"
+MANIFEST = "manifest.json"
+ISO_DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+# Foreign keys whose column name differs from the referenced primary key
+REFERENCES = {
+    ("staffs", "manager_id"): "staff_id",
+}
+
+
+def _to_array(series):
+    """
+    Converts a parsed CSV column into a typed, memory-mappable array.
+    Integers with NULLs become float64 (NaN), ISO dates datetime64[D] (NaT),
+    text fixed-width unicode ('' for NULL) since object arrays cannot be memory-mapped.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        if pd.api.types.is_integer_dtype(series):
+            return series.to_numpy(dtype=np.int64)
+        return series.to_numpy(dtype=np.float64)
+
+    values = series.dropna().astype(str)
+    if len(values) and values.str.match(ISO_DATE_PATTERN).all():
+        return pd.to_datetime(series).to_numpy().astype("datetime64[D]")
+    return series.fillna("").astype(str).to_numpy(dtype=str)
+
+
+def _csv_fingerprint(csv_files):
+    return {os.path.basename(f): [os.path.getsize(f), int(os.path.getmtime(f))] for f in csv_files}
+
+
+def _primary_key(table, columns):
+    # The bike store files start with their primary key: brands -> brand_id, categories -> category_id
+    first = columns[0]
+    stem = first[:-3]
+    if first.endswith("_id") and table in (f"{stem}s", f"{stem[:-1]}ies"):
+        return first
+    return None
+
+
+def _key_index(keys):
+    """
+    Sorted keys and the rows they come from, for lookups with np.searchsorted.
+    """
+    order = np.argsort(keys, kind="stable")
+    return keys[order], order
+
+
+def _join_rows(values, target_keys, target_rows):
+    """
+    Row of the referenced table for every value, -1 when there is no match (or NULL).
+    """
+    rows = np.full(len(values), -1, dtype=np.int64)
+    valid = ~np.isnan(values) if values.dtype.kind == "f" else np.ones(len(values), dtype=bool)
+    candidates = values[valid].astype(target_keys.dtype)
+    positions = np.searchsorted(target_keys, candidates)
+    positions[positions == len(target_keys)] = 0
+    found = target_keys[positions] == candidates
+    rows[np.flatnonzero(valid)[found]] = target_rows[positions[found]]
+    return rows
+
+
+def build_snapshot(csv_dir=DEFAULT_CSV_DIR, snapshot_dir=DEFAULT_SNAPSHOT_DIR, scale=1):
+    """
+    Converts every CSV file of a directory into one .npy file per column, plus
+    precomputed indexes on the id columns:
+    - <table>/__key_<column>.npy / __rows_<column>.npy: primary key lookup index
+    - <table>/__join_<column>.npy: row of the referenced table for each foreign key value
+
+    :param csv_dir: Directory containing the CSV files.
+    :param snapshot_dir: Output directory.
+    :param scale: Replicates orders and order items this many times to get a bigger dataset.
+    :return: The manifest describing the snapshot.
+    """
+    csv_files = sorted(glob.glob(os.path.join(csv_dir, "*.csv")))
+    manifest = {"source": _csv_fingerprint(csv_files), "scale": scale, "tables": {}}
+    arrays = {}
+
+    for file_path in csv_files:
+        table = os.path.splitext(os.path.basename(file_path))[0]
+        df = scale_frame(pd.read_csv(file_path), scale)
+        os.makedirs(os.path.join(snapshot_dir, table), exist_ok=True)
+
+        arrays[table] = {}
+        for column in df.columns:
+            array = _to_array(df[column])
+            np.save(os.path.join(snapshot_dir, table, f"{column}.npy"), array)
+            arrays[table][column] = array
+
+        manifest["tables"][table] = {
+            "rows": len(df),
+            "columns": list(df.columns),
+            "primary_key": _primary_key(table, list(df.columns)),
+            "references": {},
+        }
+
+    # Primary key indexes
+    key_indexes = {}
+    for table, info in manifest["tables"].items():
+        key = info["primary_key"]
+        if key and len(np.unique(arrays[table][key])) == info["rows"]:
+            key_indexes[key] = (table, *_key_index(arrays[table][key]))
+            np.save(os.path.join(snapshot_dir, table, f"__key_{key}.npy"), key_indexes[key][1])
+            np.save(os.path.join(snapshot_dir, table, f"__rows_{key}.npy"), key_indexes[key][2])
+        else:
+            info["primary_key"] = None
+
+    # Join indexes: each *_id column pointing to another table's primary key
+    for table, info in manifest["tables"].items():
+        for column in info["columns"]:
+            target_key = REFERENCES.get((table, column), column)
+            if column == info["primary_key"] or not column.endswith("_id") or target_key not in key_indexes:
+                continue
+            rows = _join_rows(arrays[table][column], key_indexes[target_key][1], key_indexes[target_key][2])
+            np.save(os.path.join(snapshot_dir, table, f"__join_{column}.npy"), rows)
+            info["references"][column] = key_indexes[target_key][0]
+
+    with open(os.path.join(snapshot_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class Table:
+    """
+    Columns of one table, memory-mapped on first access.
+    """
+
+    def __init__(self, snapshot_dir, name, info):
+        self.path = os.path.join(snapshot_dir, name)
+        self.name = name
+        self.info = info
+        self._columns = {}
+
+    def __len__(self):
+        return self.info["rows"]
+
+    def _load(self, file_name):
+        if file_name not in self._columns:
+            self._columns[file_name] = np.load(os.path.join(self.path, f"{file_name}.npy"), mmap_mode="r")
+        return self._columns[file_name]
+
+    def __getitem__(self, column):
+        if column not in self.info["columns"]:
+            raise KeyError(f"Column '{column}' not found in table '{self.name}'")
+        return self._load(column)
+
+    def join(self, column):
+        """
+        Row positions in the referenced table for each row (-1 when missing).
+        """
+        if column not in self.info["references"]:
+            raise KeyError(f"No join index on {self.name}.{column}")
+        return self._load(f"__join_{column}")
+
+    def lookup(self, keys):
+        """
+        Row positions of primary key values (-1 when missing).
+        """
+        key = self.info["primary_key"]
+        if key is None:
+            raise KeyError(f"Table '{self.name}' has no primary key index")
+        return _join_rows(np.asarray(keys), self._load(f"__key_{key}"), self._load(f"__rows_{key}"))
+
+
+class Snapshot:
+    def __init__(self, snapshot_dir, manifest):
+        self.snapshot_dir = snapshot_dir
+        self.manifest = manifest
+        self._tables = {}
+
+    def table(self, name):
+        if name not in self._tables:
+            self._tables[name] = Table(self.snapshot_dir, name, self.manifest["tables"][name])
+        return self._tables[name]
+
+    def related(self, table, column, target_column):
+        """
+        Value of target_column in the referenced table for every row of table,
+        e.g. related("order_items", "order_id", "store_id") -> store of each order line.
+        Rows without a match get NaN (numbers) or '' (text).
+        """
+        source = self.table(table)
+        target = self.table(source.info["references"][column])[target_column]
+        return take(target, source.join(column))
+
+
+def take(values, rows):
+    """
+    values[rows] for row positions from join() / lookup(), where -1 means no match:
+    those get NaN (numbers), NaT (dates) or '' (text) instead of the last row.
+    """
+    rows = np.asarray(rows)
+    values = np.asarray(values)[rows]
+    missing = rows < 0
+    if missing.any():
+        if values.dtype.kind in "iuf":
+            values = values.astype(np.float64)
+            values[missing] = np.nan
+        elif values.dtype.kind == "M":
+            values[missing] = np.datetime64("NaT")
+        else:
+            values[missing] = ""
+    return values
+
+
+def present(keys):
+    """
+    Mask of the keys that are not missing (NaN keys of NULL or unmatched rows).
+    """
+    keys = np.asarray(keys)
+    return ~np.isnan(keys) if keys.dtype.kind == "f" else np.ones(len(keys), dtype=bool)
+
+
+def load_snapshot(csv_dir=DEFAULT_CSV_DIR, snapshot_dir=DEFAULT_SNAPSHOT_DIR, scale=1):
+    """
+    Opens the snapshot, building it first when it is missing or older than the CSV files.
+    """
+    manifest_path = os.path.join(snapshot_dir, MANIFEST)
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    csv_files = sorted(glob.glob(os.path.join(csv_dir, "*.csv")))
+    if manifest is None or manifest["scale"] != scale or (csv_files and manifest["source"] != _csv_fingerprint(csv_files)):
+        manifest = build_snapshot(csv_dir, snapshot_dir, scale)
+    return Snapshot(snapshot_dir, manifest)
+
+
+def group_sum(keys, values):
+    """
+    Vectorized GROUP BY key SUM(value). Returns (unique keys, sums).
+    """
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=values, minlength=len(unique))
+
+
+def group_count(keys):
+    unique, counts = np.unique(keys, return_counts=True)
+    return unique, counts
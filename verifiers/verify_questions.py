@@ -0,0 +1,102 @@
+import sys
+import time
+import numpy as np
+import pandas as pd
+from snapshot import load_snapshot, group_sum, group_count, present, take, DEFAULT_CSV_DIR
+from calculate_revenue import store_revenue
+from verify_stock import stock_quantity
+
+
+def top_customers(snap, limit=5):
+    items = snap.table('order_items')
+    customers = snap.table('customers')
+    revenue = items['quantity'] * items['list_price'] * (1 - items['discount'])
+    # Lines of unknown orders or orders without a customer belong to no one
+    customer_ids = snap.related('order_items', 'order_id', 'customer_id')
+    valid = present(customer_ids)
+    keys, totals = group_sum(customer_ids[valid], np.asarray(revenue)[valid])
+    top = np.argsort(-totals)[:limit]
+    rows = customers.lookup(keys[top])
+    first, last = take(customers['first_name'], rows), take(customers['last_name'], rows)
+    return [(f"{first[n]} {last[n]}".strip(), round(float(totals[i]), 2)) for n, i in enumerate(top)]
+
+
+def best_selling_brands(snap, limit=3):
+    items = snap.table('order_items')
+    brands = snap.table('brands')
+    # Group on integer ids, names are only looked up for the winners
+    brand_ids = take(snap.table('products')['brand_id'], items.join('product_id'))
+    valid = present(brand_ids)
+    keys, totals = group_sum(brand_ids[valid], np.asarray(items['quantity'], dtype=np.float64)[valid])
+    top = np.argsort(-totals)[:limit]
+    names = take(brands['brand_name'], brands.lookup(keys[top]))
+    return [(str(name), int(totals[i])) for name, i in zip(names, top)]
+
+
+def staff_with_most_orders(snap):
+    staffs = snap.table('staffs')
+    staff_ids = np.asarray(snap.table('orders')['staff_id'])
+    keys, counts = group_count(staff_ids[present(staff_ids)])
+    best = np.argmax(counts)
+    rows = staffs.lookup(keys[best:best + 1])
+    first, last = take(staffs['first_name'], rows), take(staffs['last_name'], rows)
+    return f"{first[0]} {last[0]}".strip(), int(counts[best])
+
+
+def products_out_of_stock(snap):
+    products = snap.table('products')
+    stocks = snap.table('stocks')
+    keys, totals = group_sum(np.asarray(stocks['product_id']), np.asarray(stocks['quantity'], dtype=np.float64))
+    in_stock = keys[totals > 0]
+    mask = ~np.isin(np.asarray(products['product_id']), in_stock)
+    return sorted(np.asarray(products['product_name'])[mask].tolist())
+
+
+def average_price_by_brand(snap):
+    products = snap.table('products')
+    brand_names = snap.related('products', 'brand_id', 'brand_name')
+    keys, totals = group_sum(brand_names, np.asarray(products['list_price']))
+    _, counts = group_count(brand_names)
+    return {str(brand): round(float(total / count), 2) for brand, total, count in zip(keys, totals, counts)}
+
+
+# Questions of questions.txt checked against the snapshot
+QUESTIONS = {
+    "What is the total revenue generated by each store?": store_revenue,
+    "Who are the top 5 customers based on total money spent?": top_customers,
+    "How many 'Mountain Bikes' are currently in stock at the 'Baldwin Bikes' store?":
+        lambda snap: stock_quantity(snap, 'Mountain Bikes', 'Baldwin Bikes'),
+    "List the top 3 best-selling brands by total quantity sold.": best_selling_brands,
+    "Which staff member has processed the highest number of orders?": staff_with_most_orders,
+    "What are the names of products that have zero stock in all stores?": products_out_of_stock,
+    "Calculate the average list price of products for each brand.": average_price_by_brand,
+}
+
+
+if __name__ == "__main__":
+    # python verifiers/verify_questions.py [scale]
+    scale = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    snapshot_dir = "./bike-store-snapshot" if scale == 1 else f"./bike-store-snapshot-x{scale}"
+
+    # One-time conversion (skipped when the snapshot is up to date)
+    start = time.perf_counter()
+    load_snapshot(snapshot_dir=snapshot_dir, scale=scale)
+    print(f"Snapshot ready in {time.perf_counter() - start:.3f}s")
+
+    start = time.perf_counter()
+    snap = load_snapshot(snapshot_dir=snapshot_dir, scale=scale)
+    print(f"Snapshot opened in {(time.perf_counter() - start) * 1000:.1f}ms "
+          f"({len(snap.table('order_items'))} order items)")
+
+    start = time.perf_counter()
+    for question, verify in QUESTIONS.items():
+        question_start = time.perf_counter()
+        answer = verify(snap)
+        print(f"\n{question} ({(time.perf_counter() - question_start) * 1000:.1f}ms)\n{answer}")
+    print(f"\nVerified {len(QUESTIONS)} questions in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    # For reference: the previous approach parsed the CSV files on every run
+    start = time.perf_counter()
+    for table in ('stores', 'orders', 'order_items', 'stocks', 'products', 'categories', 'customers', 'brands', 'staffs'):
+        pd.read_csv(f"{DEFAULT_CSV_DIR}/{table}.csv")
+    print(f"Parsing the original (x1) CSV files alone takes {(time.perf_counter() - start) * 1000:.1f}ms")
@@ -1,36 +1,38 @@
+import sys
+import numpy as np
+from snapshot import load_snapshot, take
 
-import pandas as pd
-
-# Load necessary CSVs
-stocks = pd.read_csv('bike-store-data/stocks.csv')
-products = pd.read_csv('bike-store-data/products.csv')
-categories = pd.read_csv('bike-store-data/categories.csv')
-stores = pd.read_csv('bike-store-data/stores.csv')
-
-# Filter for 'Mountain Bikes' category (checking actual category name)
-mb_category = categories[categories['category_name'] == 'Mountain Bikes']
-if mb_category.empty:
-    print("Error: Category 'Mountain Bikes' not found.")
-else:
-    category_id = mb_category.iloc[0]['category_id']
-    
-    # Filter for 'Baldwin Bikes' store
-    baldwin_store = stores[stores['store_name'] == 'Baldwin Bikes']
-    if baldwin_store.empty:
-        print("Error: Store 'Baldwin Bikes' not found.")
-    else:
-        store_id = baldwin_store.iloc[0]['store_id']
-        
-        # Get all product IDs for Mountain Bikes
-        mb_products = products[products['category_id'] == category_id]
-        mb_product_ids = mb_products['product_id'].tolist()
-        
-        # Filter stocks for these products at this store
-        store_stocks = stocks[
-            (stocks['store_id'] == store_id) & 
-            (stocks['product_id'].isin(mb_product_ids))
-        ]
-        
-        total_quantity = store_stocks['quantity'].sum()
-        
-        print(f"Total 'Mountain Bikes' in stock at 'Baldwin Bikes': {total_quantity}")
+
+def stock_quantity(snap, category_name, store_name):
+    """
+    Total units in stock of a category at a store, or None when the category / store does not exist.
+    """
+    categories = snap.table('categories')
+    stores = snap.table('stores')
+    stocks = snap.table('stocks')
+
+    # Check that the category and the store exist
+    if not (np.asarray(categories['category_name']) == category_name).any():
+        print(f"Error: Category '{category_name}' not found.")
+        return None
+    if not (np.asarray(stores['store_name']) == store_name).any():
+        print(f"Error: Store '{store_name}' not found.")
+        return None
+
+    # Category of each stock row (stocks -> products -> categories) and its store name
+    product_categories = snap.related('products', 'category_id', 'category_name')
+    stock_categories = take(product_categories, stocks.join('product_id'))
+    stock_stores = snap.related('stocks', 'store_id', 'store_name')
+
+    mask = (stock_categories == category_name) & (stock_stores == store_name)
+    return int(np.asarray(stocks['quantity'])[mask].sum())
+
+
+if __name__ == "__main__":
+    # python verifiers/verify_stock.py ["Category name"] ["Store name"]
+    category_name = sys.argv[1] if len(sys.argv) > 1 else 'Mountain Bikes'
+    store_name = sys.argv[2] if len(sys.argv) > 2 else 'Baldwin Bikes'
+
+    total_quantity = stock_quantity(load_snapshot(), category_name, store_name)
+    if total_quantity is not None:
+        print(f"Total '{category_name}' in stock at '{store_name}': {total_quantity}")